@@ -1,10 +1,29 @@
-from flask import Flask, jsonify, request, render_template, redirect, session, url_for
+import time
+_import_started = time.perf_counter()
+
+import hashlib
+
+from flask import Flask, Response, g, has_app_context, has_request_context, jsonify, request, render_template, redirect, session, url_for
 from model import *
-from classifier import classify_message  # Import classify_message function
+from worker import ClassificationWorkerPool, enqueue_message
+from events import broker
+import dedupe
+import ingest
+import metrics
+import retention
+import search
+from metrics import http_request_duration, http_requests, webhook_stage_duration
+from tasks import AUTO_ASSIGN, CLAIM_NEXT_MAX, IN_PROGRESS, claim_task, claim_next_tasks, dispatcher
+import classifier
+from classifier import result_cache
+from prefilter import cascade
 from functools import wraps
+from contextlib import contextmanager
+from sqlalchemy import event, func
 from sqlalchemy.orm import joinedload
 from datetime import datetime
 import os
+import traceback
 from twilio.twiml.messaging_response import MessagingResponse
 
 app = Flask(__name__)
@@ -16,14 +35,96 @@ app.secret_key = 'your-secret-key-here'  # Change this in production
 ADMIN_EMAIL = "admin@example.com"
 ADMIN_PASSWORD = "admin@example.com"
 
+# Warn about sessions that still hold a connection when a request ends
+DB_SESSION_DEBUG = os.environ.get("DB_SESSION_DEBUG", "0") == "1"
+
+def get_db():
+    """The request's database session; close_db() closes it when the request ends."""
+    if 'db_session' not in g:
+        g.db_session = Session()
+    return g.db_session
+
+@app.teardown_appcontext
+def close_db(error):
+    db_session = g.pop('db_session', None)
+    if db_session is not None:
+        db_session.close()  # rolls back anything left uncommitted
+    if DB_SESSION_DEBUG:
+        close_leaked_sessions()
+
+if DB_SESSION_DEBUG:
+    @event.listens_for(Session, 'after_begin')
+    def track_session(db_session, transaction, connection):
+        if has_app_context() and id(db_session) not in g.setdefault('opened_sessions', {}):
+            # Where the session was first used, skipping SQLAlchemy's own frames
+            frames = [frame for frame in traceback.extract_stack()[:-1] if 'sqlalchemy' not in frame.filename]
+            endpoint = request.endpoint if has_request_context() else None
+            g.opened_sessions[id(db_session)] = (db_session, endpoint, ''.join(traceback.format_list(frames[-3:])))
+
+def close_leaked_sessions():
+    for db_session, endpoint, opened_at in g.pop('opened_sessions', {}).values():
+        if db_session.in_transaction():
+            print(f"⚠️ Database session left open by {endpoint or 'app context'}, first used at:\n{opened_at}")
+            db_session.close()
+
+# How the classifier model is brought up:
+#   background - load and warm up in a thread; /readyz reports 503 until it is hot (default)
+#   eager      - load and warm up before the app finishes importing
+#   lazy       - load on the first classification
+MODEL_LOADING = os.environ.get("MODEL_LOADING", "background")
+
+# Duration in ms of each startup phase, reported by /readyz
+startup_timings = {'imports': round((time.perf_counter() - _import_started) * 1000, 1)}
+
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    yield
+    startup_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"⏱️ Startup phase {name}: {startup_timings[name]} ms")
+
 # Ensure database and tables exist
-Base.metadata.create_all(engine)
-initialize_db()
+with startup_phase('database'):
+    initialize_db()
+
+# Background classification of queued WhatsApp messages
+with startup_phase('workers'):
+    classification_workers = ClassificationWorkerPool()
+    classification_workers.start()
+
+# Periodic archiving of old solved messages, when RETENTION_INTERVAL is set
+retention.start_scheduler()
+
+if MODEL_LOADING == 'eager':
+    with startup_phase('model'):
+        classifier.warmup()
+elif MODEL_LOADING == 'background':
+    classifier.warmup_in_background()
+
+@app.before_request
+def start_request_timer():
+    # Registered before require_login so redirected requests are timed too
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_metrics(error):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    # The URL rule rather than the path, so label values stay bounded
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_request_duration.observe(time.perf_counter() - started, method=request.method, route=route)
+    http_requests.inc(method=request.method, route=route, status=g.pop('response_status', 500))
 
 @app.before_request
 def require_login():
     # Public routes that don't require login
-    public_routes = ['login', 'static', 'whatsapp']
+    public_routes = ['login', 'static', 'whatsapp', 'healthz', 'readyz', 'prometheus_metrics']
     
     # Check if route is public
     if request.endpoint and request.endpoint in public_routes:
@@ -40,48 +141,89 @@ def require_login():
 @app.route('/whatsapp', methods=['POST'])
 def whatsapp():
     """
-    Endpoint to handle incoming WhatsApp messages, classify them, and store them in the database.
+    Endpoint to handle incoming WhatsApp messages. The raw message is stored as
+    Unclassified and queued; classification happens in the background workers.
+    A near-duplicate of one of the sender's open messages is counted on that
+    message instead and not classified again.
     """
     incoming_msg = request.values.get('Body', '').strip()
     sender = request.values.get('From', '')
 
     print(f"📨 Message from {sender}: {incoming_msg}")
 
-    # Classify the message
-    predicted_label = classify_message(incoming_msg)
-    print(f"🔍 Classified as: {predicted_label}")
-    # Create a response
-    resp = MessagingResponse()
-    resp.message(f"Hey, We have received your issue. Our team will resolve it shortly. Thank you for using our service.")
-
-
-    # Determine the routing team based on the query type
-    db_session = Session()
+    reply = "Hey, We have received your issue. Our team will resolve it shortly. Thank you for using our service."
+    db_session = get_db()
     try:
-        routing_team = db_session.query(Team).filter_by(category=predicted_label).first()
-        routing_team_name = routing_team.name if routing_team else "Other"
-
-        # Add the classified message to the database
-        new_message = Message(
-            queryNumber=db_session.query(Message).count() + 1,  # Auto-increment queryNumber
-            message=incoming_msg,
-            routingTeam=routing_team_name,  # Assign the correct routing team
-            queryType=predicted_label,
-            confidentialityLevel=80,  # Default confidentiality level
-            status="Pending"
-        )
-        db_session.add(new_message)
-        db_session.commit()
-        print(f"✅ Message saved to database with ID: {new_message.id}")
+        received_at = time.time()
+        with webhook_stage_duration.time(stage="dedupe"):
+            fingerprint = dedupe.simhash(incoming_msg)
+            duplicate_id = dedupe.find_duplicate(db_session, sender, fingerprint, received_at)
+        if duplicate_id is not None:
+            repeat_count, team = dedupe.record_repeat(db_session, duplicate_id, incoming_msg, received_at)
+            with webhook_stage_duration.time(stage="commit"):
+                db_session.commit()
+            print(f"🔁 Repeat of message {duplicate_id} from {sender} ({repeat_count} so far)")
+            broker.publish('message', {'id': duplicate_id, 'repeatCount': repeat_count}, team=team)
+            return twiml_reply("We already have your issue and our team is working on it. Thank you for your patience.")
+
+        # Store the raw message and its queue entry in one transaction
+        with webhook_stage_duration.time(stage="query_number"):
+            query_number = query_numbers.next()
+        with webhook_stage_duration.time(stage="insert"):
+            new_message = Message(
+                queryNumber=query_number,
+                message=incoming_msg,
+                queryType=UNCLASSIFIED,
+                status="Pending",
+                sender=sender or None,
+                simhash=fingerprint,
+                receivedAt=received_at,
+                repeatCount=0
+            )
+            db_session.add(new_message)
+            enqueue_message(db_session, new_message)
+        with webhook_stage_duration.time(stage="commit"):
+            db_session.commit()
     except Exception as e:
         db_session.rollback()
         print(f"❌ Error saving message to database: {str(e)}")
-    finally:
-        db_session.close()
+        # Not stored: answer with an error so Twilio delivers the message again
+        return "Message could not be stored, please retry", 503, {'Retry-After': '5'}
+
+    print(f"✅ Message queued for classification with ID: {new_message.id}")
+    with webhook_stage_duration.time(stage="notify"):
+        classification_workers.notify()
+        # Not routed yet, so only admins hear about it; the team is told once it is classified
+        broker.publish('message', {'id': new_message.id, 'queryNumber': new_message.queryNumber})
+    return twiml_reply(reply)
 
-    # Respond to the sender
+def twiml_reply(text):
+    with webhook_stage_duration.time(stage="twiml"):
+        resp = MessagingResponse()
+        resp.message(text)
     return str(resp), 200, {'Content-Type': 'text/xml'}  # Ensure Twilio receives the response in XML format
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """
+    Readiness: only report ready once the classifier is hot, so the load
+    balancer does not route traffic to a worker that is still loading the model.
+    """
+    model_ready = classifier.is_ready()
+    ready = model_ready or MODEL_LOADING == 'lazy'
+    return jsonify({
+        'ready': ready,
+        'model_loading': MODEL_LOADING,
+        'model_ready': model_ready,
+        'startup_ms': startup_timings,
+        'model_ms': classifier.load_timings
+    }), 200 if ready else 503
+
 def get_nav_items(active_page):
     if session.get('user_type') == 'admin':
         return [
@@ -108,22 +250,23 @@ def login():
             return redirect(url_for('home'))
         
         
-        db_session = Session()
-        try:
-            member = db_session.query(TeamMember).filter_by(email=email).first()
+        db_session = get_db()
+        member = db_session.query(TeamMember).filter_by(email=email).first()
+        
+        if member and password == member.email:
             
-            if member and password == member.email:
-                
-                member.status = 'active'
-                db_session.commit()
-                
-                session['user_type'] = 'member'
-                session['member_id'] = member.id
-                return redirect(url_for('member_dashboard'))
+            member.status = 'active'
+            db_session.commit()
+            if AUTO_ASSIGN and member.team:
+                in_progress = db_session.query(func.count(Message.id)).filter_by(
+                    assigned_to=member.id, status=IN_PROGRESS).scalar()
+                dispatcher.member_active(member.id, member.team.name, in_progress)
             
-            return render_template('login.html', error='Invalid credentials')
-        finally:
-            db_session.close()
+            session['user_type'] = 'member'
+            session['member_id'] = member.id
+            return redirect(url_for('member_dashboard'))
+        
+        return render_template('login.html', error='Invalid credentials')
     
     return render_template('login.html')
 
@@ -132,14 +275,14 @@ def logout():
     if 'user_type' in session and session['user_type'] == 'member':
         member_id = session.get('member_id')
         if member_id:
-            db_session = Session()
-            try:
-                member = db_session.query(TeamMember).get(member_id)
-                if member:
-                    member.status = 'inactive'
-                    db_session.commit()
-            finally:
-                db_session.close()
+            db_session = get_db()
+            member = db_session.query(TeamMember).get(member_id)
+            if member:
+                member.status = 'inactive'
+                db_session.commit()
+                if AUTO_ASSIGN:
+                    # Hand all of their in-progress work, picked by hand or assigned, to teammates still online
+                    dispatcher.release(db_session, member_id)
     
     session.clear()
     return redirect(url_for('login'))
@@ -182,7 +325,7 @@ def home():
 def teams():
     if session.get('user_type') != 'admin':
         return redirect(url_for('member_dashboard'))
-    db_session = Session()
+    db_session = get_db()
     all_teams = db_session.query(Team).all()
     return render_template('team.html',
                          nav_items=get_nav_items('teams'),
@@ -196,30 +339,211 @@ def settings():
     return render_template('settings.html',
                          nav_items=get_nav_items('settings'))
 
+# Page size for /api/messages
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+# Most rows returned by one ?since= delta request
+DELTA_MAX_ROWS = 1000
+
+def collection_etag(name, version, *parts):
+    """Weak ETag for a message collection: any message change bumps `version`."""
+    key = ':'.join(str(part) for part in (*parts, request.query_string.decode()))
+    return f"{name}-{version}-{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+def not_modified(etag):
+    return request.if_none_match.contains_weak(etag)
+
+def not_modified_response(etag, version):
+    return conditional_headers(app.response_class(status=304), etag, version)
+
+def conditional_headers(response, etag, version):
+    response.set_etag(etag, weak=True)
+    # Let browsers keep the body but revalidate every time
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Change-Version'] = str(version)
+    return response
+
+def changes_since(query, since, current_version):
+    """
+    Rows of `query` changed after `since`, oldest change first, and the version
+    to pass as `since` next time. Rows sharing a version are never split
+    across two responses.
+    """
+    rows = query.filter(Message.changeVersion > since).order_by(
+        Message.changeVersion, Message.id).limit(DELTA_MAX_ROWS + 1).all()
+    if len(rows) <= DELTA_MAX_ROWS:
+        return rows, current_version, False
+    cutoff = rows[DELTA_MAX_ROWS].changeVersion
+    rows = [row for row in rows if row.changeVersion < cutoff]
+    if not rows:
+        rows = query.filter(Message.changeVersion == cutoff).all()
+    return rows, rows[-1].changeVersion, True
+
 @app.route('/api/messages', methods=['GET'])
 @login_required
 def get_messages():
-    session = Session()
-    messages = session.query(Message).all()
-    return jsonify([{
-        '_id': message.id,
-        'queryNumber': message.queryNumber,
-        'message': message.message,
-        'routingTeam': message.routingTeam,
-        'queryType': message.queryType,  
-        'confidentialityLevel': message.confidentialityLevel,
-        'status': message.status
-    } for message in messages])
+    """
+    Newest-first page of messages. Pass the returned `next_cursor` as `cursor`
+    to get the next page; `team`, `status` and `queryType` filter server-side.
+
+    With `since=<version>` only messages changed after that version are
+    returned: `messages` holds changed rows that match the filters, `removed`
+    the ids of changed rows that no longer do or were archived, and `version` is the value to
+    send as `since` next time. Unchanged responses are answered with 304.
+    """
+    try:
+        limit = min(int(request.args.get('limit', MESSAGES_PAGE_SIZE)), MESSAGES_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor', type=int)
+        since = request.args.get('since', type=int)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    filters = {
+        'routingTeam': request.args.get('team'),
+        'status': request.args.get('status'),
+        'queryType': request.args.get('queryType')
+    }
+    filters = {column: value for column, value in filters.items() if value}
+
+    db_session = get_db()
+    version = current_change_version(db_session)
+    etag = collection_etag('messages', version)
+    if not_modified(etag):
+        return not_modified_response(etag, version)
+
+    # Select only the serialized columns instead of hydrating Message objects
+    query = db_session.query(
+        Message.id,
+        Message.queryNumber,
+        Message.message,
+        Message.routingTeam,
+        Message.queryType,
+        Message.confidentialityLevel,
+        Message.status,
+        Message.sender,
+        Message.repeatCount,
+        Message.changeVersion
+    )
+
+    def serialize(row):
+        return {
+            '_id': row.id,
+            'queryNumber': row.queryNumber,
+            'message': row.message,
+            'routingTeam': row.routingTeam,
+            'queryType': row.queryType,
+            'confidentialityLevel': row.confidentialityLevel,
+            'status': row.status,
+            'sender': row.sender,
+            'repeatCount': row.repeatCount or 0,
+            'changeVersion': row.changeVersion
+        }
+
+    if since is not None:
+        rows, next_since, more = changes_since(query, since, version)
+        matches = lambda row: all(getattr(row, column) == value for column, value in filters.items())
+        archived = db_session.query(ArchivedMessage.id).filter(
+            ArchivedMessage.archivedVersion > since, ArchivedMessage.archivedVersion <= next_since)
+        response = jsonify({
+            'messages': [serialize(row) for row in rows if matches(row)],
+            'removed': [row.id for row in rows if not matches(row)] + [row.id for row in archived],
+            'version': next_since,
+            'more': more
+        })
+        return conditional_headers(response, etag, version)
+
+    for column, value in filters.items():
+        query = query.filter(getattr(Message, column) == value)
+    if cursor is not None:
+        query = query.filter(Message.id < cursor)
+    rows = query.order_by(Message.id.desc()).limit(limit).all()
+
+    response = jsonify({
+        'messages': [serialize(row) for row in rows],
+        'next_cursor': rows[-1].id if len(rows) == limit else None,
+        'version': version
+    })
+    return conditional_headers(response, etag, version)
+
+@app.route('/api/messages/search', methods=['GET'])
+@login_required
+def search_messages():
+    """
+    Full-text search of message text: `q` is free text, every word must
+    match (the last one as a prefix). `team` and `status` filter. Results
+    are best match first, paged with `offset`; with `order=newest` they are
+    newest first and paged with `cursor` like /api/messages.
+    """
+    q = request.args.get('q', '').strip()
+    order = request.args.get('order', 'rank')
+    try:
+        limit = min(int(request.args.get('limit', search.SEARCH_PAGE_SIZE)), search.SEARCH_MAX_PAGE_SIZE)
+        offset = int(request.args.get('offset', 0))
+        cursor = request.args.get('cursor', type=int)
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({'error': 'limit must be positive and offset not negative'}), 400
+    if offset > search.SEARCH_MAX_OFFSET:
+        return jsonify({'error': f'offset is limited to {search.SEARCH_MAX_OFFSET}; narrow the search'}), 400
+    if order not in ('rank', 'newest'):
+        return jsonify({'error': 'order must be rank or newest'}), 400
+
+    rows = search.search_messages(get_db(), q, team=request.args.get('team'), status=request.args.get('status'),
+                                  limit=limit, offset=offset, cursor=cursor, order=order)
+    if rows is None:
+        return jsonify({'error': 'q must contain at least one word'}), 400
+
+    full_page = len(rows) == limit
+    return jsonify({
+        'messages': [{
+            '_id': message.id,
+            'queryNumber': message.queryNumber,
+            'message': message.message,
+            'routingTeam': message.routingTeam,
+            'queryType': message.queryType,
+            'confidentialityLevel': message.confidentialityLevel,
+            'status': message.status,
+            'rank': round(rank, 4) if rank is not None else None
+        } for message, rank in rows],
+        'next_offset': offset + limit if full_page and order == 'rank' else None,
+        'next_cursor': rows[-1][0].id if full_page and order == 'newest' else None
+    })
+
+@app.route('/api/messages/<int:message_id>/repeats', methods=['GET'])
+@login_required
+def get_message_repeats(message_id):
+    """Texts of the near-duplicates folded into a message, oldest first; for admins and the message's team."""
+    db_session = get_db()
+    message = db_session.query(Message.routingTeam).filter_by(id=message_id).first() or \
+        db_session.query(ArchivedMessage.routingTeam).filter_by(id=message_id).first()
+    if not message:
+        return jsonify({'error': 'Message not found'}), 404
+    if session.get('user_type') != 'admin':
+        member_id = session.get('member_id')
+        member = member_id and db_session.query(TeamMember).options(joinedload(TeamMember.team)).get(member_id)
+        if not member or not member.team or member.team.name != message.routingTeam:
+            return jsonify({'error': 'Unauthorized'}), 403
+    repeats = db_session.query(MessageRepeat).filter_by(message_id=message_id).order_by(
+        MessageRepeat.receivedAt, MessageRepeat.id).all()
+    return jsonify([{'message': repeat.message, 'receivedAt': repeat.receivedAt} for repeat in repeats])
 
 @app.route('/api/messages/<message_id>/solve', methods=['POST'])
 @login_required
 def solve_message(message_id):
     try:
-        session = Session()
-        message = session.query(Message).filter_by(id=message_id).first()
+        db_session = get_db()
+        message = db_session.query(Message).filter_by(id=message_id).first()
         if message:
+            was_in_progress = message.status == IN_PROGRESS
             message.status = 'Solved'
-            session.commit()
+            db_session.commit()
+            if was_in_progress and message.assigned_to:
+                dispatcher.adjust(message.assigned_to, -1)
+            broker.publish('task', {'id': message.id, 'status': message.status},
+                           team=message.routingTeam, member_id=message.assigned_to)
             return jsonify({'message': 'Message marked as solved!'})
         return jsonify({'error': 'Message not found'}), 404
     except Exception as e:
@@ -234,9 +558,9 @@ def team_management():
 @login_required
 def get_teams():
     try:
-        session = Session()
+        db_session = get_db()
         
-        teams = session.query(Team).options(joinedload(Team.members)).all()
+        teams = db_session.query(Team).options(joinedload(Team.members)).all()
         return jsonify([{
             'id': team.id,
             'name': team.name,
@@ -252,13 +576,11 @@ def get_teams():
         } for team in teams])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        session.close()
 
 @app.route('/api/teams/<int:team_id>', methods=['GET'])
 def get_team_details(team_id):
     try:
-        db_session = Session()
+        db_session = get_db()
         
         team = db_session.query(Team).options(joinedload(Team.members)).get(team_id)
         if not team:
@@ -278,12 +600,11 @@ def get_team_details(team_id):
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        db_session.close()
 
 @app.route('/api/teams/<int:team_id>/members', methods=['POST'])
 @login_required  
 def add_team_member(team_id):
+    db_session = get_db()
     try:
         data = request.json
         if not data:
@@ -295,7 +616,6 @@ def add_team_member(team_id):
         if not all(field in data for field in required_fields):
             return jsonify({'error': 'Missing required fields'}), 400
         
-        db_session = Session()
         team = db_session.query(Team).get(team_id)
         
         if not team:
@@ -336,8 +656,6 @@ def add_team_member(team_id):
         print(f"Error adding member to team {team_id}:", str(e))
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db_session.close()
 
 @app.route('/member/dashboard')
 @login_required
@@ -349,7 +667,7 @@ def member_dashboard():
     if not member_id:
         return redirect('/login')
     
-    db_session = Session()
+    db_session = get_db()
     member = db_session.query(TeamMember).get(member_id)
     return render_template('member_dashboard.html', 
                          member=member,
@@ -364,7 +682,7 @@ def my_tasks_page():
     if not member_id:
         return redirect('/login')
     
-    db_session = Session()
+    db_session = get_db()
     member = db_session.query(TeamMember).get(member_id)
     tasks = db_session.query(Message).filter_by(
         assigned_to=member_id,
@@ -385,7 +703,7 @@ def resolved_tasks_page():
     if not member_id:
         return redirect('/login')
     
-    db_session = Session()
+    db_session = get_db()
     member = db_session.query(TeamMember).get(member_id)
     tasks = db_session.query(Message).filter_by(
         assigned_to=member_id,
@@ -407,17 +725,14 @@ def member_profile():
     if not member_id:
         return redirect('/login')
     
-    db_session = Session()
-    try:
-        member = db_session.query(TeamMember).options(joinedload(TeamMember.team)).get(member_id)
-        if not member:
-            return redirect('/logout')
-        
-        return render_template('member_profile.html',
-                             member=member,
-                             nav_items=get_nav_items('profile'))
-    finally:
-        db_session.close()
+    db_session = get_db()
+    member = db_session.query(TeamMember).options(joinedload(TeamMember.team)).get(member_id)
+    if not member:
+        return redirect('/logout')
+    
+    return render_template('member_profile.html',
+                         member=member,
+                         nav_items=get_nav_items('profile'))
 
 @app.route('/api/member/queries')
 @login_required
@@ -426,7 +741,7 @@ def get_member_queries():
     if not member_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    db_session = Session()
+    db_session = get_db()
     member = db_session.query(TeamMember).get(member_id)
     team_queries = db_session.query(Message).filter_by(routingTeam=member.team.name).all()
     
@@ -445,27 +760,43 @@ def get_team_queries():
     if not member_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    db_session = Session()
-    try:
-        member = db_session.query(TeamMember).options(joinedload(TeamMember.team)).get(member_id)
-        if not member or not member.team:
-            return jsonify([])  
-        
-        
-        team_queries = db_session.query(Message).filter_by(
-            routingTeam=member.team.name,
-            assigned_to=None
-        ).all()
-        
-        return jsonify([{
-            'id': q.id,
-            'queryNumber': q.queryNumber,
-            'message': q.message,
-            'queryType': q.queryType,
-            'status': q.status
-        } for q in team_queries])
-    finally:
-        db_session.close()
+    db_session = get_db()
+    version = current_change_version(db_session)
+    etag = collection_etag('team-queries', version, member_id)
+    if not_modified(etag):
+        return not_modified_response(etag, version)
+
+    member = db_session.query(TeamMember).options(joinedload(TeamMember.team)).get(member_id)
+    if not member or not member.team:
+        return jsonify([])  
+    
+    serialize = lambda q: {
+        'id': q.id,
+        'queryNumber': q.queryNumber,
+        'message': q.message,
+        'queryType': q.queryType,
+        'status': q.status
+    }
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        # Changed rows of the team; those that were picked up meanwhile are removed
+        changed, next_since, more = changes_since(
+            db_session.query(Message).filter(Message.routingTeam == member.team.name), since, version)
+        response = jsonify({
+            'queries': [serialize(q) for q in changed if q.assigned_to is None],
+            'removed': [q.id for q in changed if q.assigned_to is not None],
+            'version': next_since,
+            'more': more
+        })
+        return conditional_headers(response, etag, version)
+
+    team_queries = db_session.query(Message).filter_by(
+        routingTeam=member.team.name,
+        assigned_to=None
+    ).all()
+    
+    return conditional_headers(jsonify([serialize(q) for q in team_queries]), etag, version)
 
 @app.route('/api/member/pick-task/<int:query_id>', methods=['POST'])
 @login_required
@@ -474,18 +805,56 @@ def pick_task(query_id):
     if not member_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    db_session = Session()
-    query = db_session.query(Message).get(query_id)
-    
-    if query.assigned_to:
-        return jsonify({'error': 'Query already assigned'}), 400
-        
-    query.assigned_to = member_id
-    query.status = 'In Progress'
+    db_session = get_db()
+    if not claim_task(db_session, query_id, member_id):
+        db_session.rollback()
+        if db_session.query(Message.id).filter_by(id=query_id).first() is None:
+            return jsonify({'error': 'Query not found'}), 404
+        return jsonify({'error': 'Query already assigned'}), 409
     db_session.commit()
+    dispatcher.adjust(member_id, 1)
+    team = db_session.query(Message.routingTeam).filter_by(id=query_id).scalar()
+    broker.publish('task', {'id': query_id, 'status': IN_PROGRESS, 'assigned_to': member_id},
+                   team=team, member_id=member_id)
     
     return jsonify({'message': 'Query assigned successfully'})
 
+@app.route('/api/member/claim-next', methods=['POST'])
+@login_required
+def claim_next():
+    """Claim the `count` oldest unassigned queries of the member's team (JSON body or query string)."""
+    member_id = session.get('member_id')
+    if not member_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('count', request.args.get('count', 1)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'count must be an integer'}), 400
+    if not 1 <= count <= CLAIM_NEXT_MAX:
+        return jsonify({'error': f'count must be between 1 and {CLAIM_NEXT_MAX}'}), 400
+
+    db_session = get_db()
+    member = db_session.query(TeamMember).options(joinedload(TeamMember.team)).get(member_id)
+    if not member or not member.team:
+        return jsonify({'error': 'Member has no team'}), 400
+
+    claimed = claim_next_tasks(db_session, member_id, member.team.name, count)
+    db_session.commit()
+    dispatcher.adjust(member_id, len(claimed))
+    for task in claimed:
+        broker.publish('task', {'id': task.id, 'status': task.status, 'assigned_to': member_id},
+                       team=task.routingTeam, member_id=member_id)
+
+    return jsonify({'claimed': [{
+        'id': q.id,
+        'queryNumber': q.queryNumber,
+        'message': q.message,
+        'queryType': q.queryType,
+        'status': q.status
+    } for q in claimed]})
+
 @app.route('/api/member/my-tasks')
 @login_required
 def get_my_tasks():
@@ -493,19 +862,39 @@ def get_my_tasks():
     if not member_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    db_session = Session()
-    tasks = db_session.query(Message).filter_by(
-        assigned_to=member_id,
-        status='In Progress'
-    ).all()
-    
-    return jsonify([{
+    db_session = get_db()
+    version = current_change_version(db_session)
+    etag = collection_etag('my-tasks', version, member_id)
+    if not_modified(etag):
+        return not_modified_response(etag, version)
+
+    serialize = lambda q: {
         'id': q.id,
         'queryNumber': q.queryNumber,
         'message': q.message,
         'queryType': q.queryType,
         'status': q.status
-    } for q in tasks])
+    }
+
+    since = request.args.get('since', type=int)
+    if since is not None:
+        # Changed tasks of the member; those no longer in progress are removed
+        changed, next_since, more = changes_since(
+            db_session.query(Message).filter(Message.assigned_to == member_id), since, version)
+        response = jsonify({
+            'tasks': [serialize(q) for q in changed if q.status == 'In Progress'],
+            'removed': [q.id for q in changed if q.status != 'In Progress'],
+            'version': next_since,
+            'more': more
+        })
+        return conditional_headers(response, etag, version)
+
+    tasks = db_session.query(Message).filter_by(
+        assigned_to=member_id,
+        status='In Progress'
+    ).all()
+    
+    return conditional_headers(jsonify([serialize(q) for q in tasks]), etag, version)
 
 @app.route('/api/member/resolved-tasks')
 @login_required
@@ -514,7 +903,7 @@ def get_resolved_tasks():
     if not member_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    db_session = Session()
+    db_session = get_db()
     tasks = db_session.query(Message).filter_by(
         assigned_to=member_id,
         status='Solved'
@@ -535,7 +924,7 @@ def solve_query(query_id):
     if not member_id:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    db_session = Session()
+    db_session = get_db()
     try:
         query = db_session.query(Message).get(query_id)
         if not query:
@@ -544,18 +933,21 @@ def solve_query(query_id):
         if query.assigned_to != member_id:
             return jsonify({'error': 'Not authorized to solve this query'}), 403
             
-        member = db_session.query(TeamMember).get(member_id)
+        if query.status == 'Solved':
+            return jsonify({'message': 'Query marked as solved'})
         
         query.status = 'Solved'
-        member.issues_solved += 1
+        db_session.query(TeamMember).filter_by(id=member_id).update(
+            {TeamMember.issues_solved: TeamMember.issues_solved + 1}, synchronize_session=False)
         db_session.commit()
+        dispatcher.adjust(member_id, -1)
+        broker.publish('task', {'id': query.id, 'status': query.status},
+                       team=query.routingTeam, member_id=member_id)
         
         return jsonify({'message': 'Query marked as solved'})
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db_session.close()
 
 @app.route('/api/reset-request', methods=['POST'])
 def request_reset():
@@ -567,7 +959,7 @@ def request_reset():
     if not email:
         return jsonify({'error': 'Email is required'}), 400
     
-    db_session = Session()
+    db_session = get_db()
     try:
         member = db_session.query(TeamMember).filter_by(email=email).first()
         if not member:
@@ -580,14 +972,13 @@ def request_reset():
         )
         db_session.add(reset_request)
         db_session.commit()
+        broker.publish('password-reset', {'id': reset_request.id, 'status': reset_request.status})
         
         return jsonify({'message': 'Reset request submitted successfully'})
         
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db_session.close()
 
 @app.route('/api/reset-requests', methods=['GET'])
 @login_required
@@ -595,18 +986,15 @@ def get_reset_requests():
     if session.get('user_type') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 403
         
-    db_session = Session()
-    try:
-        requests = db_session.query(PasswordReset).join(TeamMember).all()
-        return jsonify([{
-            'id': req.id,
-            'member_name': req.member.name,
-            'member_email': req.member.email,
-            'requested_at': req.requested_at,
-            'status': req.status
-        } for req in requests])
-    finally:
-        db_session.close()
+    db_session = get_db()
+    requests = db_session.query(PasswordReset).join(TeamMember).all()
+    return jsonify([{
+        'id': req.id,
+        'member_name': req.member.name,
+        'member_email': req.member.email,
+        'requested_at': req.requested_at,
+        'status': req.status
+    } for req in requests])
 
 @app.route('/api/reset-password', methods=['POST'])
 @login_required
@@ -618,7 +1006,7 @@ def reset_password():
     request_id = data.get('requestId')
     new_password = data.get('newPassword')
     
-    db_session = Session()
+    db_session = get_db()
     try:
         reset_request = db_session.query(PasswordReset).get(request_id)
         if not reset_request:
@@ -628,19 +1016,256 @@ def reset_password():
         member.password = new_password  
         db_session.delete(reset_request) 
         db_session.commit()
+        broker.publish('password-reset', {'id': request_id, 'status': 'completed'})
         
         return jsonify({'message': 'Password reset successful'})
     except Exception as e:
         db_session.rollback()
         return jsonify({'error': str(e)}), 500
-    finally:
-        db_session.close()
 
 @app.route('/api/query-types', methods=['GET'])
 @login_required
 def get_query_types():
     return jsonify(QUERY_TYPES)
 
+@app.route('/api/classifier/cache', methods=['GET'])
+@login_required
+def get_classifier_cache_stats():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(result_cache.stats())
+
+@app.route('/api/stats', methods=['GET'])
+@login_required
+def get_stats():
+    """
+    Pending / in-progress / solved counts per team and per member, read from
+    the maintained counters. Members only see their team and themselves.
+    """
+    db_session = get_db()
+    query = db_session.query(MessageCounter)
+    if session.get('user_type') != 'admin':
+        member_id = session.get('member_id')
+        member = member_id and db_session.query(TeamMember).options(joinedload(TeamMember.team)).get(member_id)
+        if not member:
+            return jsonify({'error': 'Unauthorized'}), 401
+        query = query.filter(
+            ((MessageCounter.scope == 'team') & (MessageCounter.key == (member.team.name if member.team else None))) |
+            ((MessageCounter.scope == 'member') & (MessageCounter.key == str(member.id)))
+        )
+
+    stats = {'teams': {}, 'members': {}}
+    for counter in query.all():
+        stats['teams' if counter.scope == 'team' else 'members'][counter.key] = {
+            'pending': counter.pending,
+            'in_progress': counter.in_progress,
+            'solved': counter.solved
+        }
+    return jsonify(stats)
+
+# Uploaded ingest files are kept here so an interrupted import can be resumed
+INGEST_UPLOAD_DIR = os.environ.get("INGEST_UPLOAD_DIR", "ingest_uploads")
+
+@app.route('/api/ingest', methods=['POST'])
+@login_required
+def start_ingest():
+    """
+    Bulk import an uploaded .csv or .jsonl file (form field `file`) in the
+    background. Uploading the same file again resumes an interrupted import;
+    pass restart=1 to import it from the start.
+    """
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'file is required'}), 400
+    extension = os.path.splitext(upload.filename)[1].lower()
+    if extension not in ('.csv', '.jsonl'):
+        return jsonify({'error': 'file must be .csv or .jsonl'}), 400
+
+    # Name the stored copy after its content, so re-uploads map to the same checkpoint
+    os.makedirs(INGEST_UPLOAD_DIR, exist_ok=True)
+    digest = hashlib.sha1()
+    partial = os.path.join(INGEST_UPLOAD_DIR, f".upload-{os.getpid()}-{id(upload)}")
+    with open(partial, 'wb') as f:
+        for block in iter(lambda: upload.stream.read(1 << 20), b''):
+            digest.update(block)
+            f.write(block)
+    upload_id = digest.hexdigest()
+    path = os.path.join(INGEST_UPLOAD_DIR, upload_id + extension)
+    os.replace(partial, path)
+
+    ingest.ingest_in_background(path, restart=request.values.get('restart') == '1')
+    return jsonify({'id': upload_id + extension, 'status_url': url_for('ingest_status', upload_id=upload_id + extension)}), 202
+
+@app.route('/api/ingest/<upload_id>', methods=['GET'])
+@login_required
+def ingest_status(upload_id):
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    path = os.path.join(INGEST_UPLOAD_DIR, os.path.basename(upload_id))
+    if not os.path.exists(path):
+        return jsonify({'error': 'Upload not found'}), 404
+    status = ingest.checkpoint_status(ingest.source_key(path))
+    if status is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    status.pop('source')
+    return jsonify(status)
+
+# Page size for /api/archive/messages
+ARCHIVE_PAGE_SIZE = 50
+ARCHIVE_MAX_PAGE_SIZE = 200
+
+def serialize_archived(message):
+    return {
+        '_id': message.id,
+        'queryNumber': message.queryNumber,
+        'message': message.message,
+        'routingTeam': message.routingTeam,
+        'queryType': message.queryType,
+        'confidentialityLevel': message.confidentialityLevel,
+        'status': message.status,
+        'sender': message.sender,
+        'assigned_to': message.assigned_to,
+        'solvedAt': message.solvedAt,
+        'archivedAt': message.archivedAt
+    }
+
+@app.route('/api/archive/messages', methods=['GET'])
+@login_required
+def get_archived_messages():
+    """
+    Newest-first page of archived (old solved) messages, paged with `cursor`
+    like /api/messages; `team`, `queryType` and `assigned_to` filter.
+    """
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    try:
+        limit = min(int(request.args.get('limit', ARCHIVE_PAGE_SIZE)), ARCHIVE_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor', type=int)
+        assigned_to = request.args.get('assigned_to', type=int)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    query = get_db().query(ArchivedMessage)
+    if request.args.get('team'):
+        query = query.filter(ArchivedMessage.routingTeam == request.args['team'])
+    if request.args.get('queryType'):
+        query = query.filter(ArchivedMessage.queryType == request.args['queryType'])
+    if assigned_to is not None:
+        query = query.filter(ArchivedMessage.assigned_to == assigned_to)
+    if cursor is not None:
+        query = query.filter(ArchivedMessage.id < cursor)
+    rows = query.order_by(ArchivedMessage.id.desc()).limit(limit).all()
+    return jsonify({
+        'messages': [serialize_archived(row) for row in rows],
+        'next_cursor': rows[-1].id if len(rows) == limit else None
+    })
+
+@app.route('/api/archive/messages/<int:message_id>', methods=['GET'])
+@login_required
+def get_archived_message(message_id):
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    message = get_db().query(ArchivedMessage).get(message_id)
+    if not message:
+        return jsonify({'error': 'Message not found'}), 404
+    return jsonify(serialize_archived(message))
+
+@app.route('/api/archive/run', methods=['POST'])
+@login_required
+def run_archive():
+    """Archive messages solved more than `days` (default RETENTION_DAYS) ago in the background."""
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        days = float(data.get('days', retention.RETENTION_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'days must be a number'}), 400
+    if days < 0:
+        return jsonify({'error': 'days must not be negative'}), 400
+    if not retention.run_in_background(days, vacuum=True if data.get('vacuum') else None):
+        return jsonify({'error': 'Archiving is already running'}), 409
+    return jsonify({'status_url': url_for('archive_status')}), 202
+
+@app.route('/api/archive/status', methods=['GET'])
+@login_required
+def archive_status():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'running': retention.is_running(), 'last_run': retention.last_run})
+
+@app.route('/api/db/pool', methods=['GET'])
+@login_required
+def get_db_pool_stats():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(pool_metrics.snapshot(engine.pool))
+
+@app.route('/api/classifier/tiers', methods=['GET'])
+@login_required
+def get_classifier_tier_stats():
+    if session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(cascade.stats())
+
+def _classification_queue_depth():
+    db_session = Session()
+    try:
+        return {(): db_session.query(func.count(ClassificationJob.id)).scalar()}
+    finally:
+        db_session.close()
+
+metrics.registry.gauge("classification_queue_depth", "Messages waiting to be classified.", _classification_queue_depth)
+metrics.registry.gauge("db_pool_checked_out", "Database connections in use.",
+                       lambda: {(): engine.pool.checkedout()})
+metrics.registry.gauge("db_pool_wait_seconds_max", "Longest wait for a database connection.",
+                       lambda: {(): pool_metrics.snapshot(engine.pool)['wait_seconds_max']})
+metrics.registry.gauge("event_subscribers", "Open /api/events streams.",
+                       lambda: {(): broker.stats()['subscribers']})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics in the Prometheus text format. Set METRICS_TOKEN to require a bearer token."""
+    if metrics.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {metrics.METRICS_TOKEN}":
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+def read_change_version():
+    db_session = Session()
+    try:
+        return current_change_version(db_session)
+    finally:
+        db_session.close()
+
+@app.route('/api/events')
+@login_required
+def event_stream():
+    """
+    Server-sent events for the dashboards: `message` (stored or classified),
+    `task` (picked up or solved), `password-reset` (admins only) and `resync`
+    when the client fell behind or another worker process changed messages,
+    and it should refetch. Members only receive events of their own team.
+    """
+    broker.watch_version(read_change_version)
+    if session.get('user_type') == 'admin':
+        subscription = broker.subscribe(admin=True)
+    else:
+        member_id = session.get('member_id')
+        db_session = get_db()
+        member = db_session.query(TeamMember).options(joinedload(TeamMember.team)).get(member_id)
+        if not member:
+            return jsonify({'error': 'Unauthorized'}), 401
+        subscription = broker.subscribe(team=member.team.name if member.team else None, member_id=member.id)
+
+    return Response(broker.stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # don't let nginx buffer the stream
+    })
+
 if __name__ == '__main__':
 
     app.run(host='0.0.0.0', port=5000, debug=True)
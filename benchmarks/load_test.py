@@ -0,0 +1,299 @@
+# benchmarks/load_test.py
+#
+# End-to-end load test: starts benchmarks/serve.py on a throwaway database
+# (or targets --url), then sends Twilio-style form posts to /whatsapp and
+# logged-in member/admin API traffic at fixed rates. Reports throughput and
+# p50/p95/p99 latency per endpoint and writes them to a JSON file, which a
+# later run can --compare against. Standard library only; runs offline with
+# the stub classifier.
+#
+#   python benchmarks/load_test.py --duration 30 --whatsapp-rate 20 --member-rate 20 --admin-rate 5
+#   python benchmarks/load_test.py --real-model --compare benchmarks/results/load-<earlier>.json
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from serve import MEMBER_EMAIL
+
+ADMIN_EMAIL = "admin@example.com"
+MESSAGES = [
+    "Payment failed but money was deducted from my card",
+    "My driver never arrived at the pickup point",
+    "Unable to book a ride for tomorrow morning",
+    "The driver took a much longer route than needed",
+    "Ride is delayed by 30 minutes, still waiting",
+    "Cannot log in to my account, OTP not received",
+    "My subscription renewal was charged twice",
+    "Customer support is not responding to my complaint",
+    "hi",
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, status, seconds):
+        with self.lock:
+            self.statuses[endpoint][status] += 1
+            if status is None or status >= 500 or status == 429:
+                self.errors[endpoint] += 1
+            else:
+                self.latencies[endpoint].append(seconds)
+
+    def summary(self, duration):
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[endpoint])
+            ms = lambda value: round(value * 1000, 2) if value is not None else None
+            endpoints[endpoint] = {
+                'requests': len(values) + self.errors[endpoint],
+                'errors': self.errors[endpoint],
+                'throughput': round(len(values) / duration, 2),
+                'p50_ms': ms(percentile(values, 0.50)),
+                'p95_ms': ms(percentile(values, 0.95)),
+                'p99_ms': ms(percentile(values, 0.99)),
+                'max_ms': ms(values[-1] if values else None),
+                'statuses': {str(status): count for status, count in self.statuses[endpoint].items()}
+            }
+        return endpoints
+
+
+class Client:
+    """A browser session: cookie jar plus the tasks this member has claimed."""
+
+    def __init__(self, base_url, email=None):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.tasks = []
+        self.lock = threading.Lock()
+        if email:
+            self.request('POST', '/login', form={'email': email, 'password': email})
+
+    def request(self, method, path, form=None, body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            return None, b''
+
+
+def whatsapp_action(anonymous):
+    sender = f"whatsapp:+9198{random.randint(10000000, 99999999)}"
+    form = {
+        'Body': random.choice(MESSAGES),
+        'From': sender,
+        'To': 'whatsapp:+14155238886',
+        'WaId': sender[-12:],
+        'ProfileName': 'Load Test',
+        'MessageSid': f"SM{random.getrandbits(128):032x}",
+        'AccountSid': f"AC{random.getrandbits(128):032x}",
+        'NumMedia': '0',
+        'NumSegments': '1',
+        'SmsStatus': 'received',
+        'ApiVersion': '2010-04-01',
+    }
+    return 'POST /whatsapp', lambda: anonymous.request('POST', '/whatsapp', form=form)
+
+
+def member_action(members):
+    client = random.choice(members)
+    roll = random.random()
+    if roll < 0.5:
+        return 'GET /api/member/team-queries', lambda: client.request('GET', '/api/member/team-queries')
+    if roll < 0.75:
+        return 'GET /api/member/my-tasks', lambda: client.request('GET', '/api/member/my-tasks')
+    with client.lock:
+        task = client.tasks.pop() if client.tasks and roll >= 0.9 else None
+    if task is not None:
+        return ('POST /api/member/queries/<id>/solve',
+                lambda: client.request('POST', f'/api/member/queries/{task}/solve'))
+
+    def claim():
+        status, body = client.request('POST', '/api/member/claim-next', body={'count': 1})
+        if status == 200:
+            with client.lock:
+                client.tasks.extend(task['id'] for task in json.loads(body)['claimed'])
+        return status, body
+    return 'POST /api/member/claim-next', claim
+
+
+def admin_action(admin):
+    roll = random.random()
+    if roll < 0.5:
+        return 'GET /api/messages', lambda: admin.request('GET', '/api/messages?limit=50')
+    if roll < 0.7:
+        return 'GET /api/messages?status', lambda: admin.request('GET', '/api/messages?limit=50&status=Pending')
+    return 'GET /api/stats', lambda: admin.request('GET', '/api/stats')
+
+
+def drive(rate, duration, make_action, pool, recorder, stop):
+    """Open-loop arrivals at `rate`/s; latency counts from the scheduled start, so a slow server is not hidden."""
+    if rate <= 0:
+        return
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    sent = 0
+    while not stop.is_set():
+        scheduled = started + sent * interval
+        if scheduled - started >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        endpoint, call = make_action()
+
+        def run(endpoint=endpoint, call=call, scheduled=scheduled):
+            status, _ = call()
+            recorder.record(endpoint, status, time.perf_counter() - scheduled)
+        pool.submit(run)
+        sent += 1
+
+
+def start_server(args):
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    command = [sys.executable, os.path.join(HERE, 'serve.py'), '--workdir', workdir, '--port', str(args.port),
+               '--members', str(args.members)]
+    if not args.real_model:
+        command += ['--stub', '--stub-latency-ms', str(args.stub_latency_ms)]
+    output = subprocess.DEVNULL if args.quiet else None
+    server = subprocess.Popen(command, stdout=output, stderr=output)
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        status, _ = Client(base_url).request('GET', '/healthz')
+        if status == 200:
+            return server, base_url
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("❌ Server did not come up")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(endpoints, baseline=None):
+    print(f"\n{'endpoint':42} {'req':>6} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for endpoint, stats in endpoints.items():
+        line = (f"{endpoint:42} {stats['requests']:>6} {stats['errors']:>5} {stats['throughput']:>8} "
+                f"{stats['p50_ms'] or '-':>8} {stats['p95_ms'] or '-':>8} {stats['p99_ms'] or '-':>8}")
+        before = (baseline or {}).get(endpoint)
+        if before and before.get('p95_ms') and stats['p95_ms']:
+            line += f"   p95 {(stats['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}% vs baseline"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test app.py end to end")
+    parser.add_argument('--url', help="test a running server instead of starting one")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--duration', type=float, default=30, help="seconds of traffic")
+    parser.add_argument('--whatsapp-rate', type=float, default=20, help="webhook posts per second")
+    parser.add_argument('--member-rate', type=float, default=20, help="member API requests per second")
+    parser.add_argument('--admin-rate', type=float, default=5, help="admin API requests per second")
+    parser.add_argument('--members', type=int, default=18, help="member accounts to log in")
+    parser.add_argument('--concurrency', type=int, default=64, help="client threads")
+    parser.add_argument('--real-model', action='store_true', help="classify with the real model instead of the stub")
+    parser.add_argument('--stub-latency-ms', type=float, default=20)
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--output', help="result file (default benchmarks/results/load-<time>.json)")
+    parser.add_argument('--compare', help="earlier result file to compare p95 latency against")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quiet', action='store_true', help="hide server output")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    server = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        server, base_url = start_server(args)
+
+    try:
+        anonymous = Client(base_url)
+        admin = Client(base_url, ADMIN_EMAIL)
+        members = [Client(base_url, MEMBER_EMAIL.format(i)) for i in range(args.members)]
+
+        recorder = Recorder()
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            drivers = [
+                threading.Thread(target=drive, args=(rate, args.duration, make_action, pool, recorder, stop))
+                for rate, make_action in (
+                    (args.whatsapp_rate, lambda: whatsapp_action(anonymous)),
+                    (args.member_rate, lambda: member_action(members)),
+                    (args.admin_rate, lambda: admin_action(admin)),
+                )
+            ]
+            started = time.perf_counter()
+            for thread in drivers:
+                thread.start()
+            for thread in drivers:
+                thread.join()
+        duration = time.perf_counter() - started
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    endpoints = recorder.summary(duration)
+    result = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'duration_s': round(duration, 2),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'endpoints': endpoints
+    }
+    output = args.output or os.path.join(HERE, 'results', f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['endpoints']
+    print_report(endpoints, baseline)
+    print(f"\n💾 Results written to {output}")
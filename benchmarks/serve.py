@@ -0,0 +1,70 @@
+# benchmarks/serve.py
+#
+# Runs app.py against a throwaway database for load tests. With --stub the
+# seq2seq classifier is replaced by a deterministic stand-in that sleeps
+# --stub-latency-ms per batch, so the server runs offline without model
+# weights. Started by load_test.py; can also be run by hand.
+#
+#   python benchmarks/serve.py --workdir /tmp/bench --port 5055 --stub
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+# Password of every generated member (login checks password == email)
+MEMBER_EMAIL = "bench-member-{}@example.com"
+
+
+def stub_classify_batch(latency_ms):
+    from classifier import Classification, labels
+
+    def classify_batch(messages):
+        time.sleep(latency_ms / 1000)
+        return [Classification(labels[int(hashlib.sha1(message.encode()).hexdigest(), 16) % len(labels)],
+                               0.9, None) for message in messages]
+    return classify_batch
+
+
+def create_members(count):
+    from model import Session, Team, TeamMember
+
+    db_session = Session()
+    try:
+        teams = db_session.query(Team).order_by(Team.id).all()
+        for i in range(count):
+            email = MEMBER_EMAIL.format(i)
+            if db_session.query(TeamMember.id).filter_by(email=email).first() is None:
+                db_session.add(TeamMember(name=f"Bench member {i}", email=email, password=email,
+                                          role="Agent", team_id=teams[i % len(teams)].id))
+        db_session.commit()
+    finally:
+        db_session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve app.py for load tests")
+    parser.add_argument('--workdir', required=True, help="directory for the throwaway database")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--members', type=int, default=18)
+    parser.add_argument('--stub', action='store_true', help="replace the seq2seq model with a stand-in")
+    parser.add_argument('--stub-latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(args.workdir, 'dashboard.db')}")
+    if args.stub:
+        os.environ["MODEL_LOADING"] = "lazy"
+        import classifier
+        classifier.batcher.batch_fn = stub_classify_batch(args.stub_latency_ms)
+        classifier._ready.set()
+
+    import app
+    create_members(args.members)
+    print(f"🏁 Serving on 127.0.0.1:{args.port} ({'stub' if args.stub else 'real'} classifier)", flush=True)
+    app.app.run(host='127.0.0.1', port=args.port, threaded=True, debug=False, use_reloader=False)
@@ -0,0 +1,148 @@
+# benchmarks/sqlite_concurrency.py
+#
+# Read throughput of the dashboard queries while the webhook path keeps
+# writing, with the tuned SQLite settings (WAL, busy timeout, ...) and with
+# SQLite's defaults for comparison. Runs against a throwaway database file.
+# Every reader and writer is its own process, like gunicorn workers, so the
+# numbers show SQLite locking rather than threads waiting for the GIL.
+#
+#   python benchmarks/sqlite_concurrency.py --seconds 5 --readers 4 --writers 2
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from model import Base, Message, Sequence, MESSAGE_VERSION, QUERY_TYPES, SQLITE_PRAGMAS, create_db_engine
+
+# The teams initialize_db() creates
+TEAMS = ["Bookings", "Subscriptions", "Payments", "Driver Operations", "Ride Operations", "Route Operations",
+         "Account Management", "Support", "Admin"]
+
+
+def seed(db_engine, rows):
+    # Core insert: Message() would check team names against the app's own database
+    with db_engine.begin() as connection:
+        connection.execute(insert(Message), [{
+            'queryNumber': i,
+            'message': f"seed message {i}",
+            'routingTeam': TEAMS[i % len(TEAMS)],
+            'queryType': QUERY_TYPES[i % len(QUERY_TYPES)],
+            'status': "Pending",
+            'changeVersion': i
+        } for i in range(1, rows + 1)])
+        # So concurrent writers only ever bump the version row
+        connection.execute(insert(Sequence).values(name=MESSAGE_VERSION, value=rows))
+
+
+def read_loop(Session, stop, index):
+    team = TEAMS[index % len(TEAMS)]
+    reads, locked, latencies = 0, 0, []
+    while not stop.is_set():
+        started = time.perf_counter()
+        db_session = Session()
+        try:
+            db_session.query(Message).filter_by(routingTeam=team, assigned_to=None) \
+                .order_by(Message.id.desc()).limit(50).all()
+            reads += 1
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            locked += 1
+        finally:
+            db_session.close()
+    return {'reads': reads, 'writes': 0, 'locked': locked, 'latencies': latencies}
+
+
+def write_loop(Session, stop, index):
+    number = 10_000_000 * (index + 1)
+    writes, locked = 0, 0
+    while not stop.is_set():
+        db_session = Session()
+        try:
+            # One message per transaction, like /whatsapp
+            db_session.add(Message(queryNumber=number, message=f"incoming {number}",
+                                   queryType="Unclassified", status="Pending"))
+            db_session.commit()
+            number += 1
+            writes += 1
+        except OperationalError:
+            db_session.rollback()
+            locked += 1
+        finally:
+            db_session.close()
+    return {'reads': 0, 'writes': writes, 'locked': locked, 'latencies': []}
+
+
+def worker(role, index, url, pragmas, ready, stop, results):
+    db_engine = create_db_engine(url, pragmas=pragmas, pool_size=1)
+    Session = sessionmaker(bind=db_engine)
+    ready.wait()
+    loop = read_loop if role == 'reader' else write_loop
+    results.put(loop(Session, stop, index))
+    db_engine.dispose()
+
+
+def run(url, pragmas, seconds, readers, writers):
+    context = multiprocessing.get_context("spawn")
+    roles = [('reader', i) for i in range(readers)] + [('writer', i) for i in range(writers)]
+    # Start measuring once every process has imported the app and connected
+    ready = context.Barrier(len(roles) + 1)
+    stop = context.Event()
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(role, index, url, pragmas, ready, stop, results))
+                 for role, index in roles]
+    for process in processes:
+        process.start()
+    ready.wait()
+    time.sleep(seconds)
+    stop.set()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = sorted(latency for total in totals for latency in total['latencies']) or [0.0]
+    return {
+        'reads/s': round(sum(total['reads'] for total in totals) / seconds, 1),
+        'writes/s': round(sum(total['writes'] for total in totals) / seconds, 1),
+        'p95 read ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        'locked errors': sum(total['locked'] for total in totals)
+    }
+
+
+def benchmark(name, pragmas, args):
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        db_engine = create_db_engine(url, pragmas=pragmas)
+        Base.metadata.create_all(db_engine)
+        seed(db_engine, args.rows)
+        db_engine.dispose()
+
+        reads_only = run(url, pragmas, args.seconds, args.readers, 0)
+        mixed = run(url, pragmas, args.seconds, args.readers, args.writers)
+
+    held = mixed['reads/s'] / reads_only['reads/s'] * 100 if reads_only['reads/s'] else 0
+    print(f"\n{name}")
+    print(f"  reads only : {reads_only}")
+    print(f"  with writes: {mixed}")
+    print(f"  read throughput held: {held:.0f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SQLite read throughput under concurrent writes")
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=20000, help="messages seeded before measuring")
+    args = parser.parse_args()
+
+    # Rollback journal and no busy timeout (the driver still waits up to its 5 s default)
+    benchmark("SQLite defaults", {}, args)
+    benchmark("Tuned (" + ", ".join(f"{k}={v}" for k, v in SQLITE_PRAGMAS.items()) + ")", None, args)
@@ -0,0 +1,217 @@
+# cache.py
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from model import Session, ClassificationCacheEntry
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(text):
+    """Case-fold, drop punctuation and collapse whitespace so trivial variants share a key."""
+    text = _PUNCTUATION.sub(" ", (text or "").lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a size bound and per-entry TTL."""
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ClassificationCache:
+    """
+    Two-level cache of classification results: an in-process LRU in front of the
+    classification_cache table, so hits survive restarts. Keys include `version`,
+    which changes whenever the model, prompt or label set changes. Rows older
+    than `db_ttl` or made by another version are purged while writing, at most
+    every `purge_interval` seconds.
+
+    Values are (label, confidence, scores) tuples; confidence and scores may be None.
+    """
+
+    def __init__(self, version, max_size=1024, ttl=3600, db_ttl=30 * 24 * 3600, persistent=True,
+                 purge_interval=3600):
+        self.version = version
+        self.db_ttl = db_ttl
+        self.persistent = persistent
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def key(self, text):
+        raw = f"{self.version}:{normalize_message(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts):
+        """Return {text: value} for every text that is cached in either level."""
+        found = {}
+        pending = {}
+        for text in texts:
+            key = self.key(text)
+            value = self.memory.get(key)
+            if value is not None:
+                found[text] = value
+            else:
+                pending.setdefault(key, []).append(text)
+
+        memory_hits = len(found)
+        db_hits = 0
+        if pending and self.persistent:
+            for key, value in self._load(list(pending)):
+                self.memory.set(key, value)
+                for text in pending.pop(key):
+                    found[text] = value
+                    db_hits += 1
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.db_hits += db_hits
+            self.misses += sum(len(missing) for missing in pending.values())
+        return found
+
+    def get(self, text):
+        return self.get_many([text]).get(text)
+
+    def set_many(self, results):
+        """Store {text: (label, confidence, scores)} in both levels."""
+        entries = {}
+        for text, value in results.items():
+            key = self.key(text)
+            value = tuple(value)[:3]
+            self.memory.set(key, value)
+            entries[key] = value
+        if entries and self.persistent:
+            self._store(entries)
+
+    def set(self, text, value):
+        self.set_many({text: value})
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            lookups = hits + self.misses
+            return {
+                'version': self.version,
+                'size': len(self.memory),
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'hits': hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+            }
+
+    def clear(self):
+        self.memory.clear()
+        with self._lock:
+            self.memory_hits = self.db_hits = self.misses = 0
+
+    def _load(self, keys):
+        db_session = Session()
+        try:
+            rows = db_session.query(
+                ClassificationCacheEntry.key,
+                ClassificationCacheEntry.label,
+                ClassificationCacheEntry.confidence,
+                ClassificationCacheEntry.scores
+            ).filter(
+                ClassificationCacheEntry.key.in_(keys),
+                ClassificationCacheEntry.created_at >= time.time() - self.db_ttl
+            ).all()
+            return [(key, (label, confidence, json.loads(scores) if scores else None))
+                    for key, label, confidence, scores in rows]
+        except Exception as e:
+            print(f"❌ Error reading classification cache: {str(e)}")
+            return []
+        finally:
+            db_session.close()
+
+    def _store(self, entries):
+        rows = [{
+            'key': key,
+            'label': label,
+            'confidence': confidence,
+            'scores': json.dumps(scores) if scores else None,
+            'version': self.version,
+            'created_at': time.time()
+        } for key, (label, confidence, scores) in entries.items()]
+        db_session = Session()
+        try:
+            connection = db_session.connection()
+            _upsert(connection, rows)
+            if time.time() - self._purged_at >= self.purge_interval:
+                self._purged_at = time.time()
+                self.purge(connection)
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            print(f"❌ Error writing classification cache: {str(e)}")
+        finally:
+            db_session.close()
+
+    def purge(self, connection):
+        """Delete rows past `db_ttl` or made by another version. Returns how many."""
+        table = ClassificationCacheEntry.__table__
+        # Rows written before versions were stored only expire by age
+        return connection.execute(delete(table).where(or_(
+            table.c.created_at < time.time() - self.db_ttl,
+            table.c.version != self.version
+        ))).rowcount
+
+
+def _upsert(connection, rows):
+    """Insert or replace cache rows with one statement."""
+    table = ClassificationCacheEntry.__table__
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+    if dialect is None:
+        connection.execute(delete(table).where(table.c.key.in_([row['key'] for row in rows])))
+        connection.execute(table.insert(), rows)
+        return
+    statement = dialect.insert(table)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.key],
+        set_={name: statement.excluded[name] for name in ('label', 'confidence', 'scores', 'version', 'created_at')}
+    ), rows)
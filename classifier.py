@@ -1,15 +1,56 @@
 # classifier.py
 
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
+import gc
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
 
-# Load model and tokenizer
+from cache import ClassificationCache
+from inference_backends import create_backend
+from inference_client import InferenceClient, InferenceTimeout, InferenceUnavailable
+from metrics import classifier_batch_size, classifier_stage_duration, inference_fallbacks
+
+# The model and tokenizer are loaded on first use (or by load_model()/warmup()),
+# so importing this module stays cheap.
 model_name = "google/flan-t5-small"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+# Inference backend: "torch" (fp32), "torch-int8" (dynamic quantization) or "onnx" (ONNX Runtime)
+CLASSIFIER_BACKEND = os.environ.get("CLASSIFIER_BACKEND", "torch")
+backend = create_backend(CLASSIFIER_BACKEND, model_name)
+_loaded = False
+
+_model_lock = threading.Lock()
+_ready = threading.Event()
+# Duration in ms of the model loading phases, for startup reporting
+load_timings = {}
+
+# "score" ranks the fixed label set in one batched pass and reports a confidence;
+# "generate" decodes free-form text as before (no confidence).
+CLASSIFIER_MODE = os.environ.get("CLASSIFIER_MODE", "score")
+
+# Micro-batching settings: concurrent calls are grouped into one padded batch
+# of at most MAX_BATCH_SIZE prompts, waiting at most MAX_WAIT_MS for it to fill.
+MAX_BATCH_SIZE = int(os.environ.get("CLASSIFIER_MAX_BATCH_SIZE", 16))
+MAX_WAIT_MS = float(os.environ.get("CLASSIFIER_MAX_WAIT_MS", 5))
+
+# Address of a shared inference_server.py ("unix:/path" or "host:port"); empty runs the model in-process
+INFERENCE_SERVER = os.environ.get("INFERENCE_SERVER", "")
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", 10))
+# When the server can't be connected to: "local" loads the model in this process
+# until the server answers again, "none" fails the batch and leaves the job in the
+# queue to be retried. A server that is only slow always gets the retry.
+INFERENCE_FALLBACK = os.environ.get("INFERENCE_FALLBACK", "local")
+# How long warmup() waits for a server that is still starting before falling back
+INFERENCE_STARTUP_WAIT = float(os.environ.get("INFERENCE_STARTUP_WAIT", 60))
+inference_client = InferenceClient(INFERENCE_SERVER, timeout=INFERENCE_TIMEOUT) if INFERENCE_SERVER else None
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
+# Result cache settings (in-process LRU backed by the classification_cache table)
+CACHE_ENABLED = os.environ.get("CLASSIFIER_CACHE", "1") != "0"
+CACHE_SIZE = int(os.environ.get("CLASSIFIER_CACHE_SIZE", 4096))
+CACHE_TTL = float(os.environ.get("CLASSIFIER_CACHE_TTL", 3600))
 
 labels = [
     "Booking Issue",
@@ -32,9 +73,270 @@ Message:
 
 Only output the exact label name."""
 
+# label: predicted label; confidence: its probability (0-1);
+# scores: {label: probability} over all labels. Both are None in generate mode.
+# tier: what produced the answer ("model", "cache", or a prefilter tier).
+Classification = namedtuple('Classification', ['label', 'confidence', 'scores', 'tier'], defaults=('model',))
+
+def model_version():
+    """Identifies the model, backend, prompt, label set and mode; cached results are only reused within a version."""
+    fingerprint = "\n".join([model_name, backend.name, CLASSIFIER_MODE, build_prompt("{message}"), *labels])
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+def load_model():
+    """Load the tokenizer and model once; concurrent callers wait for the first load."""
+    global _loaded
+    if _loaded:
+        return
+    with _model_lock:
+        if _loaded:
+            return
+        started = time.perf_counter()
+        # Timed on its own: importing torch/transformers is a large share of startup
+        import torch
+        import transformers
+        load_timings['import'] = round((time.perf_counter() - started) * 1000, 1)
+
+        started = time.perf_counter()
+        backend.load()
+        _loaded = True
+        load_timings['load'] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"🧠 Loaded {model_name} ({backend.name}) on {backend.device} in {load_timings['load']} ms")
+
+def unload_model():
+    """Drop the in-process model, so memory is only held while it is used."""
+    global _loaded
+    with _model_lock:
+        if not _loaded:
+            return
+        backend.unload()
+        _loaded = False
+        gc.collect()
+    print(f"🧠 Unloaded the in-process {model_name}; the inference server is answering again")
+
+def warmup():
+    """
+    Load the model and run one throwaway batch so the first real request is
+    not slow. With an inference server, check that it answers instead.
+    """
+    if inference_client is not None:
+        deadline = time.monotonic() + INFERENCE_STARTUP_WAIT
+        while True:
+            try:
+                status = inference_client.status()
+                print(f"🧠 Using inference server {INFERENCE_SERVER} ({status['backend']})")
+                _ready.set()
+                return
+            except InferenceUnavailable as e:
+                if time.monotonic() < deadline:
+                    time.sleep(1)
+                    continue
+                if INFERENCE_FALLBACK != "local":
+                    raise
+                print(f"⚠️ Inference server unavailable, loading the model in-process: {str(e)}")
+                break
+    load_model()
+    started = time.perf_counter()
+    classify_batch(["warmup"])
+    load_timings['warmup'] = round((time.perf_counter() - started) * 1000, 1)
+    _ready.set()
+
+def warmup_in_background():
+    thread = threading.Thread(target=_warmup_safely, name="classifier-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def _warmup_safely():
+    try:
+        warmup()
+    except Exception as e:
+        print(f"❌ Error warming up classifier: {str(e)}")
+
+def is_ready():
+    """True once the model is loaded and has served the warmup batch."""
+    return _ready.is_set()
+
+def generate_batch(messages):
+    """Classify a list of messages by free-form decoding in a single padded batch."""
+    import torch
+    load_model()
+    prompts = [build_prompt(message) for message in messages]
+    with classifier_stage_duration.time(stage="tokenize"):
+        inputs = backend.tokenizer(prompts, return_tensors="pt", truncation=True, padding=True).to(backend.device)
+    with classifier_stage_duration.time(stage="generate"), torch.no_grad():
+        outputs = backend.generate(inputs.input_ids, inputs.attention_mask, max_length=32)
+    with classifier_stage_duration.time(stage="decode"):
+        results = backend.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+    return [Classification(result.strip(), None, None) for result in results]
+
+_label_targets = None
+
+def _get_label_targets():
+    global _label_targets
+    if _label_targets is None:
+        import torch
+
+        encoded = backend.tokenizer(labels, return_tensors="pt", padding=True)
+        targets = encoded.input_ids.to(backend.device)
+        # Decoder inputs are the targets shifted right behind the start token
+        start = torch.full((targets.size(0), 1), backend.decoder_start_token_id,
+                           dtype=targets.dtype, device=targets.device)
+        decoder_inputs = torch.cat([start, targets[:, :-1]], dim=1)
+        _label_targets = (targets, encoded.attention_mask.to(backend.device), decoder_inputs)
+    return _label_targets
+
+def score_batch(messages):
+    """
+    Classify a list of messages by scoring every label as a candidate decoder
+    sequence. The encoder runs once per message; all (message, label) pairs are
+    then decoded together in one teacher-forced pass. The label log-likelihoods
+    are normalised into a distribution over `labels`, so the answer is always
+    one of them.
+    """
+    import torch
+    load_model()
+    prompts = [build_prompt(message) for message in messages]
+    with classifier_stage_duration.time(stage="tokenize"):
+        inputs = backend.tokenizer(prompts, return_tensors="pt", truncation=True, padding=True).to(backend.device)
+    label_ids, label_mask, label_decoder_inputs = _get_label_targets()
+    batch_size, label_count = len(messages), len(labels)
+
+    with torch.no_grad():
+        with classifier_stage_duration.time(stage="encode"):
+            encoded = backend.encode(inputs.input_ids, inputs.attention_mask)
+        # Every message is paired with every label: (batch * labels, ...)
+        hidden = encoded.repeat_interleave(label_count, dim=0)
+        attention_mask = inputs.attention_mask.repeat_interleave(label_count, dim=0)
+        targets = label_ids.repeat(batch_size, 1)
+        target_mask = label_mask.repeat(batch_size, 1)
+
+        with classifier_stage_duration.time(stage="decode"):
+            logits = backend.decoder_logits(hidden, attention_mask, label_decoder_inputs.repeat(batch_size, 1))
+            token_log_probs = logits.log_softmax(dim=-1).gather(-1, targets.unsqueeze(-1)).squeeze(-1)
+            sequence_log_probs = (token_log_probs * target_mask).sum(dim=-1).view(batch_size, label_count)
+            probabilities = sequence_log_probs.softmax(dim=-1).cpu().tolist()
+
+    results = []
+    for row in probabilities:
+        best = max(range(label_count), key=row.__getitem__)
+        scores = {label: round(p, 4) for label, p in zip(labels, row)}
+        results.append(Classification(labels[best], row[best], scores))
+    return results
+
+def classify_batch(messages):
+    """Classify a list of messages with a single padded forward pass."""
+    if CLASSIFIER_MODE == "generate":
+        return generate_batch(messages)
+    return score_batch(messages)
+
+
+class BatchingEngine:
+    """
+    Collects concurrent classification requests into a queue and flushes them
+    as batches, handing every caller a Future for its own result.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="classifier-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items):
+        return [self.submit(item) for item in items]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window closed: still take whatever is already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            classifier_batch_size.observe(len(batch))
+            try:
+                with classifier_stage_duration.time(stage="batch"):
+                    results = self.batch_fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+def run_batch(messages):
+    """Classify one micro-batch on the inference server, or in-process without one or when it is down."""
+    if inference_client is not None:
+        try:
+            with classifier_stage_duration.time(stage="remote"):
+                results = [Classification(*result) for result in inference_client.classify_batch(messages)]
+        except InferenceTimeout:
+            # The server is up but busy; a second model copy in this worker would only add to the load
+            raise
+        except InferenceUnavailable as e:
+            if INFERENCE_FALLBACK != "local":
+                raise
+            inference_fallbacks.inc()
+            print(f"⚠️ Inference server unavailable, classifying in-process: {str(e)}")
+        else:
+            if _loaded:
+                unload_model()
+            return results
+    return classify_batch(messages)
+
+
+batcher = BatchingEngine(run_batch)
+result_cache = ClassificationCache(model_version(), max_size=CACHE_SIZE, ttl=CACHE_TTL)
+
+def classify_many(messages):
+    """Classify several messages into Classification results, batching with other callers."""
+    with classifier_stage_duration.time(stage="cache_lookup"):
+        cached = result_cache.get_many(messages) if CACHE_ENABLED else {}
+    # Identical texts in one call only need to be classified once
+    missing = list(dict.fromkeys(message for message in messages if message not in cached))
+    futures = batcher.submit_many(missing)
+    results = {message: future.result() for message, future in zip(missing, futures)}
+    if CACHE_ENABLED and results:
+        result_cache.set_many(results)
+    for message, value in cached.items():
+        results[message] = Classification(*value, tier='cache')
+    return [results[message] for message in messages]
+
+def classify_with_confidence(message):
+    return classify_many([message])[0]
+
+def classify_messages(messages):
+    return [result.label for result in classify_many(messages)]
+
 def classify_message(message):
-    prompt = build_prompt(message)
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True, padding=True).to(device)
-    outputs = model.generate(**inputs, max_length=32)
-    result = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return result.strip()
\ No newline at end of file
+    return classify_many([message])[0].label
@@ -0,0 +1,80 @@
+# dedupe.py
+#
+# Near-duplicate detection for incoming WhatsApp messages. Each message gets a
+# 64-bit SimHash of its words; texts that differ by a few words land within a
+# small Hamming distance. A message from a sender who
+# already has a close match among their recent open messages is attached to
+# that ticket instead of being classified again; its text is kept in
+# message_repeats.
+
+import hashlib
+import os
+import re
+import time
+
+from sqlalchemy import func
+
+from model import Message, MessageRepeat, next_change_version
+
+DEDUPE_ENABLED = os.environ.get("DEDUPE", "1") != "0"
+# Only open messages the sender sent within this many seconds are compared
+DEDUPE_WINDOW = float(os.environ.get("DEDUPE_WINDOW", 24 * 3600))
+# Most differing fingerprint bits (out of 64) that still count as the same complaint;
+# a changed word in a short message ("cancel" -> "change my booking") moves about 7
+DEDUPE_MAX_DISTANCE = int(os.environ.get("DEDUPE_MAX_DISTANCE", 3))
+# Most recent open messages of one sender compared per incoming message
+DEDUPE_CANDIDATES = int(os.environ.get("DEDUPE_CANDIDATES", 20))
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def simhash(text):
+    """
+    64-bit SimHash of `text` as a signed integer, so it fits SQLite's
+    INTEGER. Returns None for text without words.
+    """
+    # Word pairs are left out: in a message of a dozen words they make one
+    # changed word move the fingerprint too far
+    words = _WORD.findall((text or "").lower())
+    if not words:
+        return None
+    hashes = [format(int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big"), "064b")
+              for word in words]
+    # A bit is set when most words have it set; counting per column keeps the loop in C
+    majority = len(hashes) / 2
+    fingerprint = int("".join("1" if column.count("1") > majority else "0" for column in zip(*hashes)), 2)
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def distance(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def find_duplicate(db_session, sender, fingerprint, now=None):
+    """Id of the sender's most recent open message within DEDUPE_MAX_DISTANCE of `fingerprint`, or None."""
+    if not DEDUPE_ENABLED or not sender or fingerprint is None:
+        return None
+    now = time.time() if now is None else now
+    candidates = db_session.query(Message.id, Message.simhash).filter(
+        Message.sender == sender,
+        Message.receivedAt >= now - DEDUPE_WINDOW,
+        Message.status != 'Solved'
+    ).order_by(Message.receivedAt.desc()).limit(DEDUPE_CANDIDATES).all()
+    for message_id, candidate in candidates:
+        if candidate is not None and distance(fingerprint, candidate) <= DEDUPE_MAX_DISTANCE:
+            return message_id
+    return None
+
+
+def record_repeat(db_session, message_id, text, received_at=None):
+    """
+    Count another copy of a message on the existing ticket and keep its text
+    (caller commits). Returns (repeatCount, routingTeam).
+    """
+    db_session.add(MessageRepeat(message_id=message_id, message=text,
+                                 receivedAt=time.time() if received_at is None else received_at))
+    db_session.query(Message).filter(Message.id == message_id).update({
+        Message.repeatCount: func.coalesce(Message.repeatCount, 0) + 1,
+        Message.changeVersion: next_change_version(db_session)
+    }, synchronize_session=False)
+    return db_session.query(Message.repeatCount, Message.routingTeam).filter(Message.id == message_id).one()
@@ -0,0 +1,133 @@
+# events.py
+
+import json
+import os
+import queue
+import threading
+import time
+
+# Comment line sent on idle streams so proxies keep the connection open
+HEARTBEAT_INTERVAL = float(os.environ.get("EVENTS_HEARTBEAT_INTERVAL", 15))
+# Events buffered per client; a client that falls further behind is told to resync
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))
+# Milliseconds the browser waits before reconnecting a dropped stream
+RECONNECT_DELAY_MS = 3000
+# Seconds between checks for changes committed by other processes; 0 turns the check off
+VERSION_POLL_INTERVAL = float(os.environ.get("EVENTS_VERSION_POLL_INTERVAL", 5))
+
+
+class Subscription:
+    """One open event stream. Admins see every event, members their team's and their own."""
+
+    def __init__(self, admin=False, team=None, member_id=None):
+        self.admin = admin
+        self.team = team
+        self.member_id = member_id
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, team, member_id):
+        if self.admin:
+            return True
+        return (team is not None and team == self.team) or \
+            (member_id is not None and member_id == self.member_id)
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Drop the backlog; the client refetches its data instead
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(('resync', {}))
+
+
+class EventBroker:
+    """
+    In-process publish/subscribe for server-sent events. Each open stream owns
+    a bounded queue; publish() fans an event out to the streams allowed to see
+    it. Events only reach clients connected to the same process; changes made
+    by other processes are caught by watch_version().
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def subscribe(self, admin=False, team=None, member_id=None):
+        subscription = Subscription(admin, team, member_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, name, data=None, team=None, member_id=None):
+        """
+        Send an event to admins and to members of `team` (or the member
+        `member_id`). Publish after the change is committed.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        event = (name, data or {})
+        for subscription in subscriptions:
+            if subscription.wants(team, member_id):
+                subscription.offer(event)
+
+    def watch_version(self, read_version, interval=VERSION_POLL_INTERVAL):
+        """
+        Call `read_version()` every `interval` seconds while streams are open
+        and send every stream `resync` when the value moves. Another worker
+        process may have committed the change, so its events never reached
+        this process's streams.
+        """
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def loop():
+            last = None
+            while True:
+                time.sleep(interval)
+                with self._lock:
+                    subscriptions = list(self._subscriptions)
+                if not subscriptions:
+                    last = None  # streams opened later fetch their data on connect
+                    continue
+                try:
+                    version = read_version()
+                except Exception as e:
+                    print(f"❌ Error checking for changes to push: {str(e)}")
+                    continue
+                if last is not None and version != last:
+                    for subscription in subscriptions:
+                        subscription.offer(('resync', {}))
+                last = version
+
+        self._watcher = threading.Thread(target=loop, name="events-version-watch", daemon=True)
+        self._watcher.start()
+
+    def stream(self, subscription):
+        """Generator of text/event-stream chunks; unsubscribes when the client goes away."""
+        try:
+            yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+            while True:
+                try:
+                    name, data = subscription.queue.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscriptions)}
+
+
+broker = EventBroker()
@@ -0,0 +1,145 @@
+# inference_backends.py
+
+import os
+
+# Optional settings shared by the CPU backends
+NUM_THREADS = int(os.environ.get("CLASSIFIER_NUM_THREADS", 0))  # 0 = library default
+ONNX_PATH = os.environ.get("CLASSIFIER_ONNX_PATH", "")  # directory of an exported model, reused across restarts
+
+
+class TorchBackend:
+    """
+    Eager PyTorch fp32 seq2seq model. Every backend exposes the same small
+    surface to classifier.py: a tokenizer, generate(), encode() and
+    decoder_logits(), all taking and returning torch tensors.
+    """
+
+    name = "torch"
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.tokenizer = None
+        self.model = None
+        self.device = None
+
+    def load(self):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+        if NUM_THREADS:
+            torch.set_num_threads(NUM_THREADS)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+        model.to(self.device)
+        model.eval()
+        self.model = self._prepare(model)
+
+    def _prepare(self, model):
+        return model
+
+    def unload(self):
+        self.model = None
+        self.tokenizer = None
+
+    @property
+    def decoder_start_token_id(self):
+        return self.model.config.decoder_start_token_id
+
+    def generate(self, input_ids, attention_mask, max_length):
+        return self.model.generate(input_ids=input_ids, attention_mask=attention_mask, max_length=max_length)
+
+    def encode(self, input_ids, attention_mask):
+        """Run the encoder once; returns the last hidden state."""
+        return self.model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    def decoder_logits(self, encoder_hidden, attention_mask, decoder_input_ids):
+        """Teacher-forced decoder pass over precomputed encoder states."""
+        from transformers.modeling_outputs import BaseModelOutput
+
+        return self.model(
+            encoder_outputs=BaseModelOutput(last_hidden_state=encoder_hidden),
+            attention_mask=attention_mask,
+            decoder_input_ids=decoder_input_ids
+        ).logits
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """
+    PyTorch with int8 dynamic quantization of every Linear layer. Weights are
+    stored as int8 and activations quantized on the fly, which cuts resident
+    memory and speeds up CPU matmuls. CPU only.
+    """
+
+    name = "torch-int8"
+
+    def load(self):
+        super().load()
+        if self.device.type != "cpu":
+            raise RuntimeError("The torch-int8 backend only runs on CPU")
+
+    def _prepare(self, model):
+        import torch
+
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend(TorchBackend):
+    """
+    ONNX Runtime through optimum. The model is exported on first load (or read
+    from CLASSIFIER_ONNX_PATH when it already holds an export) and run by the
+    ORT CPU execution provider.
+    """
+
+    name = "onnx"
+
+    def load(self):
+        import torch
+        from transformers import AutoTokenizer
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        except ImportError:
+            raise RuntimeError("The onnx backend needs `pip install optimum[onnxruntime]`")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.device = torch.device("cpu")
+        session_options = None
+        if NUM_THREADS:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = NUM_THREADS
+
+        if ONNX_PATH and os.path.isdir(ONNX_PATH):
+            self.model = ORTModelForSeq2SeqLM.from_pretrained(ONNX_PATH, session_options=session_options)
+        else:
+            self.model = ORTModelForSeq2SeqLM.from_pretrained(self.model_name, export=True,
+                                                              session_options=session_options)
+            if ONNX_PATH:
+                self.model.save_pretrained(ONNX_PATH)
+                self.tokenizer.save_pretrained(ONNX_PATH)
+
+    def encode(self, input_ids, attention_mask):
+        return self.model.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    def decoder_logits(self, encoder_hidden, attention_mask, decoder_input_ids):
+        from transformers.modeling_outputs import BaseModelOutput
+
+        return self.model(
+            attention_mask=attention_mask,
+            decoder_input_ids=decoder_input_ids,
+            encoder_outputs=BaseModelOutput(last_hidden_state=encoder_hidden),
+            use_cache=False
+        ).logits
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def create_backend(name, model_name):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown classifier backend '{name}', expected one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name](model_name)
@@ -0,0 +1,118 @@
+# inference_client.py
+#
+# Client side of inference_server.py. Requests and responses are JSON objects,
+# one per line, over a Unix socket ("unix:/path") or TCP ("host:port").
+# Connections are kept open and reused; a pooled connection that turns out to
+# be closed is replaced once, any other failure closes its connection and
+# raises InferenceUnavailable, or InferenceTimeout when the
+# server was reached but did not answer in time.
+
+import json
+import queue
+import socket
+import threading
+import time
+
+
+class InferenceUnavailable(Exception):
+    """The inference server could not be reached or did not answer in time."""
+
+
+class InferenceTimeout(InferenceUnavailable):
+    """The inference server took the request but did not answer in time; it is busy, not down."""
+
+
+def parse_address(address):
+    """("unix", path) for "unix:/path", ("tcp", (host, port)) for "host:port"."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Inference server address must be unix:/path or host:port, got '{address}'")
+    return "tcp", (host, int(port))
+
+
+class InferenceClient:
+    """
+    Thread-safe client with a small pool of persistent connections. After a
+    failure to reach the server it is not tried again for `retry_interval`
+    seconds, so callers fall back at once instead of each waiting for a
+    timeout. A slow answer does not count as such a failure.
+    """
+
+    def __init__(self, address, timeout=10.0, connect_timeout=1.0, retry_interval=5.0, max_connections=8):
+        self.address = address
+        self.family, self.target = parse_address(address)
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retry_interval = retry_interval
+        self._idle = queue.LifoQueue(maxsize=max_connections)
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX if self.family == "unix" else socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.connect_timeout)
+            sock.connect(self.target)
+            sock.settimeout(self.timeout)
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.makefile("rb")
+
+    def _checkout(self):
+        """(connection, reused): an idle pooled connection if there is one, else a new one."""
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _checkin(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            self._close(connection)
+
+    @staticmethod
+    def _close(connection):
+        sock, reader = connection
+        reader.close()
+        sock.close()
+
+    def request(self, payload):
+        with self._lock:
+            if time.monotonic() < self._down_until:
+                raise InferenceUnavailable(f"{self.address} failed recently")
+        for attempt in range(2):
+            connection, reused = None, False
+            try:
+                connection, reused = self._checkout() if attempt == 0 else (self._connect(), False)
+                connection[0].sendall(json.dumps(payload).encode("utf-8") + b"\n")
+                line = connection[1].readline()
+                if not line:
+                    raise ConnectionError("connection closed by the inference server")
+                response = json.loads(line)
+                break
+            except (OSError, ValueError) as e:
+                if connection is not None:
+                    self._close(connection)
+                    if isinstance(e, socket.timeout):
+                        raise InferenceTimeout(f"{self.address}: no answer within {self.timeout:g}s") from e
+                if reused and isinstance(e, OSError):
+                    # An idle connection the server closed (e.g. it restarted); try once on a new one
+                    continue
+                with self._lock:
+                    self._down_until = time.monotonic() + self.retry_interval
+                raise InferenceUnavailable(f"{self.address}: {e}") from e
+        self._checkin(connection)
+        if 'error' in response:
+            raise RuntimeError(f"Inference server error: {response['error']}")
+        return response
+
+    def classify_batch(self, messages):
+        """[(label, confidence, scores)] for `messages`, classified by the server."""
+        return [tuple(result) for result in self.request({'op': 'classify', 'messages': messages})['results']]
+
+    def status(self):
+        return self.request({'op': 'status'})
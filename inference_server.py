@@ -0,0 +1,101 @@
+# inference_server.py
+#
+# Runs the classifier model in its own process and serves it to every web
+# worker on the node, so the model is loaded once and concurrent requests of
+# all workers share the same micro-batches.
+#
+#   python inference_server.py --listen unix:/tmp/classifier.sock
+#   python inference_server.py --listen 127.0.0.1:5057
+#
+# Web workers use it when INFERENCE_SERVER is set to the same address.
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import threading
+
+# Taken out of the environment before classifier.py reads it, so the server runs the model itself
+DEFAULT_ADDRESS = os.environ.pop("INFERENCE_SERVER", "") or "unix:/tmp/classifier.sock"
+
+import classifier
+from classifier import BatchingEngine
+from inference_client import parse_address
+
+engine = BatchingEngine(classifier.classify_batch)
+_stats = {'requests': 0, 'messages': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+
+def handle(request):
+    op = request.get('op')
+    if op == 'classify':
+        messages = request.get('messages')
+        if not isinstance(messages, list) or not all(isinstance(message, str) for message in messages):
+            return {'error': 'messages must be a list of strings'}
+        results = [future.result() for future in engine.submit_many(messages)]
+        with _stats_lock:
+            _stats['requests'] += 1
+            _stats['messages'] += len(messages)
+        return {'results': [[result.label, result.confidence, result.scores] for result in results]}
+    if op == 'status':
+        with _stats_lock:
+            stats = dict(_stats)
+        return {'ready': classifier.is_ready(), 'model_version': classifier.model_version(),
+                'backend': classifier.backend.name, **stats}
+    return {'error': f"unknown op {op!r}"}
+
+
+class ConnectionHandler(socketserver.StreamRequestHandler):
+    """One web worker connection; requests are answered in order until it closes."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = handle(json.loads(line))
+            except Exception as e:
+                with _stats_lock:
+                    _stats['errors'] += 1
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def create_server(address):
+    family, target = parse_address(address)
+    if family == "unix":
+        if os.path.exists(target):
+            os.unlink(target)  # left behind by a previous run
+        return UnixServer(target, ConnectionHandler)
+    return TCPServer(target, ConnectionHandler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the message classifier to local web workers")
+    parser.add_argument('--listen', default=DEFAULT_ADDRESS, help="unix:/path or host:port")
+    args = parser.parse_args()
+
+    # Load before listening, so workers fall back to their own path until the model is hot
+    classifier.warmup()
+    server = create_server(args.listen)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"🧠 Inference server listening on {args.listen}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        family, target = parse_address(args.listen)
+        if family == "unix" and os.path.exists(target):
+            os.unlink(target)
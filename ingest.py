@@ -0,0 +1,243 @@
+# ingest.py
+#
+# Bulk import of historical messages from a CSV or JSONL file. Records are
+# streamed, classified in batches and inserted in chunked transactions; each
+# chunk commits together with a checkpoint, so re-running an interrupted
+# import continues after the last committed chunk.
+#
+#   python ingest.py backlog.csv
+#   python ingest.py backlog.jsonl --chunk-size 1000 --restart
+#
+# Each record needs the message text in a `message` (or `Body`, `text`)
+# field; an optional `status` of Pending or Solved is kept. Lines that are not
+# a JSON object are counted as skipped and reported with their line number.
+
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from itertools import islice
+
+from sqlalchemy import insert
+
+from model import (Session, Message, IngestCheckpoint, team_registry, query_numbers,
+                   count_transitions, next_change_version, initialize_db)
+from prefilter import cascade
+from worker import confidence_percent
+
+# Messages classified and inserted per transaction
+CHUNK_SIZE = int(os.environ.get("INGEST_CHUNK_SIZE", 500))
+TEXT_FIELDS = ("message", "Body", "text")
+IMPORTED_STATUSES = ("Pending", "Solved")
+
+
+def source_key(path):
+    """Checkpoint key of a file: the same path with a different size is a new import."""
+    return f"{os.path.abspath(path)}:{os.path.getsize(path)}"
+
+
+class InvalidRecord(dict):
+    """Stands in for a line that could not be read as a record; it has no text, so it is skipped."""
+
+    def __init__(self, line_number, reason):
+        super().__init__()
+        self.line_number = line_number
+        self.reason = reason
+
+
+def read_records(path):
+    """Yield dicts from a .csv (with a header row) or .jsonl file, one at a time."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            # Keep blank and broken lines as records so record counts stay stable for resuming
+            if not line:
+                yield {}
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield InvalidRecord(line_number, f"invalid JSON ({e})")
+                continue
+            if isinstance(record, dict):
+                yield record
+            else:
+                yield InvalidRecord(line_number, f"expected a JSON object, got {type(record).__name__}")
+
+
+def record_text(record):
+    for field in TEXT_FIELDS:
+        if record.get(field):
+            return str(record[field]).strip()
+    return ""
+
+
+def load_checkpoint(key, restart=False):
+    db_session = Session()
+    try:
+        checkpoint = db_session.query(IngestCheckpoint).get(key)
+        if checkpoint and restart:
+            db_session.delete(checkpoint)
+            checkpoint = None
+        if checkpoint is None:
+            checkpoint = IngestCheckpoint(source=key, records_done=0, messages_inserted=0, skipped=0,
+                                          started_at=time.time(), updated_at=time.time())
+            db_session.add(checkpoint)
+        db_session.commit()
+        return checkpoint.records_done, checkpoint.finished_at is not None
+    finally:
+        db_session.close()
+
+
+def store_chunk(key, records):
+    """Classify one chunk of records and insert it together with the checkpoint update."""
+    texts = [record_text(record) for record in records]
+    kept = [(text, record) for text, record in zip(texts, records) if text]
+    results = cascade.classify_many([text for text, _ in kept]) if kept else []
+    numbers = iter(query_numbers.reserve(len(kept))) if kept else iter(())
+
+    db_session = Session()
+    try:
+        rows = []
+        if kept:
+            version = next_change_version(db_session)
+            for (text, record), result in zip(kept, results):
+                status = record.get('status') if record.get('status') in IMPORTED_STATUSES else 'Pending'
+                rows.append({
+                    'queryNumber': next(numbers),
+                    'message': text,
+                    'routingTeam': team_registry.team_for_category(result.label) or "Other",
+                    'queryType': result.label,
+                    'confidentialityLevel': confidence_percent(result),
+                    'classifiedBy': result.tier,
+                    'status': status,
+                    'solvedAt': time.time() if status == 'Solved' else None,
+                    'changeVersion': version
+                })
+            db_session.execute(insert(Message), rows)
+            count_transitions(db_session, [(None, (row['routingTeam'], row['status'], None)) for row in rows])
+
+        db_session.query(IngestCheckpoint).filter_by(source=key).update({
+            IngestCheckpoint.records_done: IngestCheckpoint.records_done + len(records),
+            IngestCheckpoint.messages_inserted: IngestCheckpoint.messages_inserted + len(rows),
+            IngestCheckpoint.skipped: IngestCheckpoint.skipped + len(records) - len(rows),
+            IngestCheckpoint.updated_at: time.time()
+        }, synchronize_session=False)
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+    for record in records:
+        if isinstance(record, InvalidRecord):
+            print(f"⚠️ Skipped line {record.line_number}: {record.reason}")
+    return len(rows)
+
+
+def ingest_file(path, chunk_size=CHUNK_SIZE, restart=False):
+    """
+    Import `path`, resuming from its checkpoint unless `restart` is set.
+    Memory use is bounded by `chunk_size`. Returns the number of messages inserted.
+    """
+    key = source_key(path)
+    done, finished = load_checkpoint(key, restart)
+    if finished:
+        print(f"✅ {path} was already ingested (use --restart to import it again)")
+        return 0
+    if done:
+        print(f"⏩ Resuming {path} after {done} record(s)")
+
+    records = islice(read_records(path), done, None)
+    inserted = 0
+    started = time.perf_counter()
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        inserted += store_chunk(key, chunk)
+        done += len(chunk)
+        rate = inserted / (time.perf_counter() - started)
+        print(f"📥 {path}: {done} record(s) read, {inserted} message(s) inserted ({rate:.0f}/s)")
+
+    db_session = Session()
+    try:
+        db_session.query(IngestCheckpoint).filter_by(source=key).update(
+            {IngestCheckpoint.finished_at: time.time()}, synchronize_session=False)
+        db_session.commit()
+    finally:
+        db_session.close()
+    print(f"✅ Ingested {inserted} message(s) from {path}")
+    return inserted
+
+
+_running = set()
+_running_lock = threading.Lock()
+
+
+def ingest_in_background(path, restart=False):
+    """
+    Run ingest_file() in a thread unless that file is already being imported.
+    Returns its checkpoint key; progress is read back with checkpoint_status().
+    """
+    key = source_key(path)
+    with _running_lock:
+        if key in _running:
+            return key
+        _running.add(key)
+    # Create the checkpoint up front so progress can be read as soon as this returns
+    load_checkpoint(key, restart)
+
+    def run():
+        try:
+            ingest_file(path)
+        except Exception as e:
+            print(f"❌ Error ingesting {path}: {str(e)}")
+        finally:
+            with _running_lock:
+                _running.discard(key)
+
+    threading.Thread(target=run, name="ingest", daemon=True).start()
+    return key
+
+
+def is_running(key):
+    with _running_lock:
+        return key in _running
+
+
+def checkpoint_status(key):
+    db_session = Session()
+    try:
+        checkpoint = db_session.query(IngestCheckpoint).get(key)
+        if checkpoint is None:
+            return None
+        return {
+            'source': checkpoint.source,
+            'records_done': checkpoint.records_done,
+            'messages_inserted': checkpoint.messages_inserted,
+            'skipped': checkpoint.skipped,
+            'started_at': checkpoint.started_at,
+            'updated_at': checkpoint.updated_at,
+            'finished': checkpoint.finished_at is not None,
+            'running': is_running(key)
+        }
+    finally:
+        db_session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk import messages from a CSV or JSONL file")
+    parser.add_argument('path')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and import from the start")
+    args = parser.parse_args()
+
+    initialize_db()
+    ingest_file(args.path, chunk_size=args.chunk_size, restart=args.restart)
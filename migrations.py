@@ -0,0 +1,199 @@
+# migrations.py
+#
+# Versioned schema migrations for existing database files. create_all() only
+# creates missing tables, so columns and indexes added to an existing table are
+# applied here. Every step is idempotent: a fresh database already gets them
+# from create_all() and the step only records its version.
+#
+#   python migrations.py                # apply pending migrations
+#   python migrations.py --check-plans  # verify the hot queries use an index
+#   python migrations.py --rebuild-counters  # recompute message_counters from messages
+#   python migrations.py --rebuild-search    # re-index messages_fts from messages
+
+import sys
+import time
+
+from sqlalchemy import inspect, text, Column, Integer, String, Float
+
+from model import (Base, engine, Session, Message, MessageCounter, ArchivedMessage, ClassificationCacheEntry, Sequence,
+                   MessageRepeat, MESSAGE_VERSION, rebuild_counters)
+from search import create_search_index, rebuild_search_index
+
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String)
+    applied_at = Column(Float)  # epoch seconds
+
+
+def add_column(connection, table_name, column_name):
+    """Add a column declared on the model to an existing table (must be nullable)."""
+    existing = {column['name'] for column in inspect(connection).get_columns(table_name)}
+    if column_name in existing:
+        return
+    column = Base.metadata.tables[table_name].columns[column_name]
+    column_type = column.type.compile(dialect=connection.dialect)
+    connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN "{column_name}" {column_type}'))
+
+
+def create_index(connection, table_name, index_name):
+    """Create an index declared in the model's __table_args__ if it is missing."""
+    existing = {index['name'] for index in inspect(connection).get_indexes(table_name)}
+    if index_name in existing:
+        return
+    index = next(index for index in Base.metadata.tables[table_name].indexes if index.name == index_name)
+    index.create(bind=connection)
+
+
+def _classifier_columns(connection):
+    add_column(connection, 'messages', 'classifiedBy')
+
+
+def _message_indexes(connection):
+    create_index(connection, 'messages', 'ix_messages_routing_assigned')
+    create_index(connection, 'messages', 'ix_messages_assigned_status')
+
+
+def _message_filter_indexes(connection):
+    create_index(connection, 'messages', 'ix_messages_routing_team')
+    create_index(connection, 'messages', 'ix_messages_status')
+    create_index(connection, 'messages', 'ix_messages_query_type')
+
+
+def _message_change_versions(connection):
+    add_column(connection, 'messages', 'changeVersion')
+    create_index(connection, 'messages', 'ix_messages_change_version')
+    # Existing rows count as changed in id order; the sequence continues after them
+    connection.execute(text('UPDATE messages SET "changeVersion" = id WHERE "changeVersion" IS NULL'))
+    latest = connection.execute(text('SELECT MAX("changeVersion") FROM messages')).scalar() or 0
+    sequences = Sequence.__table__
+    # Older files predate the table, and this step may run before create_all()
+    sequences.create(bind=connection, checkfirst=True)
+    current = connection.execute(
+        sequences.select().where(sequences.c.name == MESSAGE_VERSION)).first()
+    if current is None:
+        connection.execute(sequences.insert().values(name=MESSAGE_VERSION, value=latest))
+    elif current.value < latest:
+        connection.execute(sequences.update().where(sequences.c.name == MESSAGE_VERSION).values(value=latest))
+
+
+def _message_senders(connection):
+    for column_name in ('sender', 'simhash', 'receivedAt', 'repeatCount'):
+        add_column(connection, 'messages', column_name)
+    create_index(connection, 'messages', 'ix_messages_sender_received')
+
+
+def _message_simhash_bigint(connection):
+    # Migration 7 created it as INTEGER, 32 bits on PostgreSQL; SQLite integers are 64 bits already
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('ALTER TABLE messages ALTER COLUMN simhash TYPE BIGINT'))
+
+
+def _message_archive(connection):
+    add_column(connection, 'messages', 'solvedAt')
+    # When older rows were solved is unknown; they age from now on
+    messages = Message.__table__
+    connection.execute(messages.update().where(
+        messages.c.status == 'Solved', messages.c.solvedAt.is_(None)).values(solvedAt=time.time()))
+    ArchivedMessage.__table__.create(bind=connection, checkfirst=True)
+
+
+def _classification_cache_purge(connection):
+    ClassificationCacheEntry.__table__.create(bind=connection, checkfirst=True)
+    add_column(connection, 'classification_cache', 'version')
+    create_index(connection, 'classification_cache', 'ix_classification_cache_created_at')
+
+
+def _message_counters(connection):
+    MessageCounter.__table__.create(bind=connection, checkfirst=True)
+    rebuild_counters(connection)
+
+
+# (version, name, step) in the order they are applied; never renumber or remove entries
+MIGRATIONS = [
+    (1, 'messages.classifiedBy', _classifier_columns),
+    (2, 'messages secondary indexes', _message_indexes),
+    (3, 'messages filter indexes', _message_filter_indexes),
+    (4, 'messages.changeVersion', _message_change_versions),
+    (5, 'message_counters', _message_counters),
+    (6, 'messages_fts search index', create_search_index),
+    (7, 'messages.sender and duplicate fingerprints', _message_senders),
+    (8, 'messages.solvedAt and messages_archive', _message_archive),
+    (9, 'classification_cache.version and age index', _classification_cache_purge),
+    (10, 'messages.simhash as BIGINT', _message_simhash_bigint),
+    (11, 'message_repeats', lambda connection: MessageRepeat.__table__.create(bind=connection, checkfirst=True)),
+]
+
+
+def run_migrations():
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    with engine.connect() as connection:
+        applied = {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as connection:
+            step(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(
+                version=version, name=name, applied_at=time.time()))
+        print(f"Applied migration {version}: {name}")
+
+
+def plan_checks():
+    """The messages queries behind each endpoint, keyed by endpoint name."""
+    session = Session()
+    try:
+        return {
+            'get_team_queries': session.query(Message).filter_by(routingTeam='Payments', assigned_to=None),
+            'get_member_queries': session.query(Message).filter_by(routingTeam='Payments'),
+            'get_my_tasks': session.query(Message).filter_by(assigned_to=1, status='In Progress'),
+            'my_tasks_page': session.query(Message).filter_by(assigned_to=1, status='In Progress'),
+            'get_resolved_tasks': session.query(Message).filter_by(assigned_to=1, status='Solved'),
+            'get_messages?team': session.query(Message.id).filter(
+                Message.routingTeam == 'Payments', Message.id < 1000).order_by(Message.id.desc()),
+            'get_messages?status': session.query(Message.id).filter(
+                Message.status == 'Pending', Message.id < 1000).order_by(Message.id.desc()),
+            'get_messages?queryType': session.query(Message.id).filter(
+                Message.queryType == 'Payment Issue', Message.id < 1000).order_by(Message.id.desc()),
+        }
+    finally:
+        session.close()
+
+
+def check_query_plans():
+    """
+    Run EXPLAIN QUERY PLAN (SQLite) for every hot messages query.
+    Returns {endpoint: (uses_index, plan lines)}.
+    """
+    results = {}
+    with engine.connect() as connection:
+        for endpoint, query in plan_checks().items():
+            statement = query.statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True})
+            plan = [row[-1] for row in connection.execute(text(f'EXPLAIN QUERY PLAN {statement}'))]
+            uses_index = any('USING' in line and 'INDEX' in line for line in plan) and \
+                not any(line.startswith('SCAN messages') or 'TEMP B-TREE' in line for line in plan)
+            results[endpoint] = (uses_index, plan)
+    return results
+
+
+if __name__ == '__main__':
+    # Create missing tables first, as initialize_db() does; some steps use them (sequences)
+    Base.metadata.create_all(engine)
+    run_migrations()
+    if '--rebuild-counters' in sys.argv:
+        with engine.begin() as connection:
+            rebuild_counters(connection)
+        print("Rebuilt message counters")
+    if '--rebuild-search' in sys.argv:
+        with engine.begin() as connection:
+            rebuild_search_index(connection)
+        print("Rebuilt message search index")
+    if '--check-plans' in sys.argv:
+        failed = False
+        for endpoint, (uses_index, plan) in check_query_plans().items():
+            print(f"{'OK  ' if uses_index else 'SCAN'} {endpoint}: {' | '.join(plan)}")
+            failed = failed or not uses_index
+        sys.exit(1 if failed else 0)
@@ -1,9 +1,127 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, func, inspect, select, update, Column, BigInteger, Integer, String, Float, ForeignKey, Index
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeout
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, joinedload
+from sqlalchemy.orm import sessionmaker, relationship, joinedload, object_session
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """Connection pool counters: checkouts, time spent waiting for a connection and timeouts."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.peak_checked_out = 0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def record_checked_out(self, checked_out):
+        with self._lock:
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+
+    def snapshot(self, pool):
+        with self._lock:
+            return {
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'peak_checked_out': self.peak_checked_out,
+                'overflow': max(pool.overflow(), 0),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds, 6),
+                'wait_seconds_max': round(self.max_wait_seconds, 6)
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long callers wait for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            pool_metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - started)
+        pool_metrics.record_checked_out(self.checkedout())
+        return connection
+
+
+# Any SQLAlchemy URL; SQLite gets the pragmas below, server databases the pool settings
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///dashboard.db")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))  # seconds; server databases only
+
+# SQLite tuning, applied to every new connection
+SQLITE_PRAGMAS = {
+    # Readers no longer block on the writer (and vice versa)
+    'journal_mode': os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    # With WAL this only gives up durability of the last commits on power loss, not consistency
+    'synchronous': os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    # Wait this many ms for the write lock instead of failing with "database is locked"
+    'busy_timeout': int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    'mmap_size': int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    'cache_size': -int(os.environ.get("SQLITE_CACHE_SIZE_KB", 64 * 1024)),  # negative = KiB
+    'temp_store': 'MEMORY',
+}
+
+def create_db_engine(url=DATABASE_URL, pragmas=None, **options):
+    """
+    Engine for `url` with the pool sized from config. SQLite connections get
+    `pragmas` (default SQLITE_PRAGMAS) as soon as they are opened.
+    """
+    settings = {
+        'echo': False,  # Set echo=False to reduce logs
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+    }
+    is_sqlite = url.startswith('sqlite')
+    if is_sqlite:
+        # The driver's own lock wait, in seconds; matches busy_timeout
+        settings['connect_args'] = {'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000, 'check_same_thread': False}
+    else:
+        settings['pool_pre_ping'] = True
+        settings['pool_recycle'] = DB_POOL_RECYCLE
+    settings.update(options)
+    db_engine = create_engine(url, **settings)
+
+    if is_sqlite:
+        pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+        @event.listens_for(db_engine, 'connect')
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return db_engine
+
 
 Base = declarative_base()
-engine = create_engine('sqlite:///dashboard.db', echo=False)  # Set echo=False to reduce logs
+engine = create_db_engine()
 Session = sessionmaker(bind=engine)
 
 QUERY_TYPES = [
@@ -18,8 +136,25 @@ QUERY_TYPES = [
     "Junk Message",
 ]
 
+# queryType of a message that is stored but still waiting in the classification queue
+UNCLASSIFIED = "Unclassified"
+
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Team queue: routingTeam = ? AND assigned_to IS NULL (also serves routingTeam = ?)
+        Index('ix_messages_routing_assigned', 'routingTeam', 'assigned_to'),
+        # My tasks / resolved tasks: assigned_to = ? AND status = ?
+        Index('ix_messages_assigned_status', 'assigned_to', 'status'),
+        # /api/messages filters; the implicit trailing id keeps each filter in keyset order
+        Index('ix_messages_routing_team', 'routingTeam'),
+        Index('ix_messages_status', 'status'),
+        Index('ix_messages_query_type', 'queryType'),
+        # Delta sync: changeVersion > ?
+        Index('ix_messages_change_version', 'changeVersion'),
+        # Duplicate check: sender = ? AND receivedAt >= ?
+        Index('ix_messages_sender_received', 'sender', 'receivedAt'),
+    )
 
     id = Column(Integer, primary_key=True)
     queryNumber = Column(Integer, unique=True)
@@ -27,22 +162,24 @@ class Message(Base):
     routingTeam = Column(String)
     queryType = Column(String)  # Added queryType field
     confidentialityLevel = Column(Integer)  # 0-100 percentage
+    classifiedBy = Column(String, nullable=True)  # classifier tier that set queryType
+    changeVersion = Column(Integer, nullable=True)  # global version of the last insert/update, see next_change_version()
     status = Column(String, default='Pending')
+    sender = Column(String, nullable=True)  # WhatsApp `From` of webhook messages
+    simhash = Column(BigInteger, nullable=True)  # signed 64-bit text fingerprint, see dedupe.simhash()
+    receivedAt = Column(Float, nullable=True)  # epoch seconds
+    repeatCount = Column(Integer, nullable=True, default=0)  # near-duplicates the sender sent afterwards
+    solvedAt = Column(Float, nullable=True)  # epoch seconds, set when status becomes Solved
     assigned_to = Column(Integer, ForeignKey('team_members.id'), nullable=True)
     assigned_member = relationship('TeamMember', backref='assigned_tasks')
 
     @staticmethod
     def get_valid_teams():
-        session = Session()
-        try:
-            return [team.name for team in session.query(Team).all()]
-        finally:
-            session.close()
+        return team_registry.names()
             
     def __init__(self, **kwargs):
         if 'routingTeam' in kwargs:
-            valid_teams = self.get_valid_teams()
-            if kwargs['routingTeam'] not in valid_teams:
+            if not team_registry.is_valid(kwargs['routingTeam']):
                 kwargs['routingTeam'] = 'Other'
         super().__init__(**kwargs)
 
@@ -54,6 +191,67 @@ class Team(Base):
     category = Column(String)
     members = relationship('TeamMember', back_populates='team', lazy='joined')
 
+class TeamRegistry:
+    """
+    In-memory copy of the teams table: the set of team names and the
+    category -> team name map used for routing. Loaded on first use and
+    reloaded after a commit that inserted, updated or deleted a Team row.
+    """
+
+    def __init__(self):
+        self._snapshot = None  # (frozenset of names, {category: name})
+        self._lock = threading.Lock()
+
+    def _get(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None:
+                session = Session()
+                try:
+                    rows = session.query(Team.name, Team.category).all()
+                finally:
+                    session.close()
+                by_category = {}
+                for name, category in rows:
+                    by_category.setdefault(category, name)
+                self._snapshot = (frozenset(name for name, _ in rows), by_category)
+            return self._snapshot
+
+    def names(self):
+        return self._get()[0]
+
+    def is_valid(self, team_name):
+        return team_name in self._get()[0]
+
+    def team_for_category(self, category):
+        """Name of the team handling `category`, or None."""
+        return self._get()[1].get(category)
+
+    def invalidate(self):
+        self._snapshot = None
+
+team_registry = TeamRegistry()
+
+@event.listens_for(Team, 'after_insert')
+@event.listens_for(Team, 'after_update')
+@event.listens_for(Team, 'after_delete')
+def _teams_changed(mapper, connection, target):
+    # Invalidated once committed: a reload before that would cache the old teams again
+    db_session = object_session(target)
+    if db_session is not None:
+        db_session.info['teams_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _reload_teams_after_commit(db_session):
+    if db_session.info.pop('teams_changed', False):
+        team_registry.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_team_changes(db_session):
+    db_session.info.pop('teams_changed', None)
+
 class TeamMember(Base):
     __tablename__ = 'team_members'
     
@@ -91,6 +289,290 @@ class PasswordReset(Base):
     status = Column(String, default='pending')  # pending, approved, rejected
     member = relationship('TeamMember', backref='password_resets')
 
+class ClassificationJob(Base):
+    __tablename__ = 'classification_queue'
+
+    id = Column(Integer, primary_key=True)
+    message_id = Column(Integer, ForeignKey('messages.id'), nullable=False)
+    enqueued_at = Column(Float)  # epoch seconds
+    claimed_at = Column(Float, nullable=True)  # set while a worker owns the job
+    claimed_by = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    message = relationship('Message')
+
+class ClassificationCacheEntry(Base):
+    __tablename__ = 'classification_cache'
+    __table_args__ = (
+        # Expired entries are purged by age
+        Index('ix_classification_cache_created_at', 'created_at'),
+    )
+
+    key = Column(String, primary_key=True)  # hash of model/prompt version + normalized text
+    label = Column(String)
+    confidence = Column(Float, nullable=True)  # probability of `label`, None in generate mode
+    scores = Column(String, nullable=True)  # JSON {label: probability}
+    version = Column(String, nullable=True)  # model/prompt version the key was made with
+    created_at = Column(Float)  # epoch seconds
+
+class ArchivedMessage(Base):
+    """A solved message moved out of `messages` by retention.py; same id as before (never reused, see archive_batch)."""
+    __tablename__ = 'messages_archive'
+    __table_args__ = (
+        Index('ix_messages_archive_routing_team', 'routingTeam'),
+        # Delta sync reports archived ids as removed: archivedVersion > ?
+        Index('ix_messages_archive_version', 'archivedVersion'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    queryNumber = Column(Integer)
+    message = Column(String)
+    routingTeam = Column(String)
+    queryType = Column(String)
+    confidentialityLevel = Column(Integer)
+    classifiedBy = Column(String, nullable=True)
+    status = Column(String)
+    sender = Column(String, nullable=True)
+    receivedAt = Column(Float, nullable=True)
+    repeatCount = Column(Integer, nullable=True)
+    solvedAt = Column(Float, nullable=True)
+    assigned_to = Column(Integer, nullable=True)
+    archivedAt = Column(Float)  # epoch seconds
+    archivedVersion = Column(Integer)  # change version of the archiving batch
+
+class MessageRepeat(Base):
+    """Text of a near-duplicate that dedupe.py counted on an open message instead of storing it as a new one."""
+    __tablename__ = 'message_repeats'
+    __table_args__ = (
+        Index('ix_message_repeats_message', 'message_id', 'receivedAt'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    message_id = Column(Integer, nullable=False)  # Message id; kept when the message is archived (same id)
+    message = Column(String)
+    receivedAt = Column(Float)  # epoch seconds
+
+class IngestCheckpoint(Base):
+    """Progress of a bulk ingest; committed together with each chunk of messages."""
+    __tablename__ = 'ingest_checkpoints'
+
+    source = Column(String, primary_key=True)  # file path and size, see ingest.source_key()
+    records_done = Column(Integer, nullable=False, default=0)  # input records consumed, including skipped ones
+    messages_inserted = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)  # records without message text or not readable
+    started_at = Column(Float)  # epoch seconds
+    updated_at = Column(Float)
+    finished_at = Column(Float, nullable=True)
+
+class Sequence(Base):
+    __tablename__ = 'sequences'
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)  # last number handed out
+
+class SequenceAllocator:
+    """
+    Hands out unique, increasing numbers from a row in the sequences table.
+    Each database round trip atomically reserves a block of `block_size`
+    numbers, so concurrent workers and processes never collide and the cost
+    does not depend on table size. Numbers left in a block when a process
+    exits are skipped.
+    """
+
+    def __init__(self, name, seed, block_size=1):
+        self.name = name
+        self.seed = seed  # callable(connection) -> starting value when the row does not exist
+        self.block_size = max(1, block_size)
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve(self.block_size)
+            value = self._next
+            self._next += 1
+            return value
+
+    def reserve(self, count):
+        """Reserve `count` consecutive numbers in one round trip; returns a range."""
+        start, end = self._reserve(count)
+        return range(start, end)
+
+    def _reserve(self, count):
+        table = Sequence.__table__
+        while True:
+            with engine.begin() as connection:
+                reserved = connection.execute(
+                    update(table)
+                    .where(table.c.name == self.name)
+                    .values(value=table.c.value + count)
+                ).rowcount
+                if reserved:
+                    end = connection.execute(
+                        select(table.c.value).where(table.c.name == self.name)
+                    ).scalar()
+                    return end - count + 1, end + 1
+            try:
+                with engine.begin() as connection:
+                    start = self.seed(connection) or 0
+                    connection.execute(table.insert().values(name=self.name, value=start))
+            except IntegrityError:
+                pass  # another process created the row first
+
+# Consecutive queryNumbers reserved per round trip; larger blocks mean fewer
+# writes to the sequences row at the cost of gaps after restarts
+QUERY_NUMBER_BLOCK_SIZE = int(os.environ.get("QUERY_NUMBER_BLOCK_SIZE", 1))
+
+query_numbers = SequenceAllocator(
+    'queryNumber',
+    seed=lambda connection: connection.execute(select(func.max(Message.queryNumber))).scalar(),
+    block_size=QUERY_NUMBER_BLOCK_SIZE
+)
+
+MESSAGE_VERSION = 'messageVersion'
+
+def next_change_version(db_session):
+    """
+    Bump the global messages change version inside the caller's transaction
+    and return it. Writers serialize on the sequences row until they commit,
+    so versions become visible in increasing order and a client asking for
+    `changeVersion > since` never skips a committed change. Bulk UPDATEs of
+    messages must set Message.changeVersion from this; ORM changes get it from
+    the before_flush hook below.
+    """
+    table = Sequence.__table__
+    connection = db_session.connection()
+    bumped = connection.execute(
+        update(table).where(table.c.name == MESSAGE_VERSION).values(value=table.c.value + 1)
+    ).rowcount
+    if not bumped:
+        start = connection.execute(select(func.max(Message.changeVersion))).scalar() or 0
+        connection.execute(table.insert().values(name=MESSAGE_VERSION, value=start + 1))
+    return connection.execute(select(table.c.value).where(table.c.name == MESSAGE_VERSION)).scalar()
+
+def current_change_version(db_session):
+    """Latest committed messages change version (a primary key lookup)."""
+    return db_session.query(Sequence.value).filter_by(name=MESSAGE_VERSION).scalar() or 0
+
+@event.listens_for(Session, 'before_flush')
+def _stamp_message_versions(db_session, flush_context, instances):
+    changed = [obj for obj in db_session.new if isinstance(obj, Message)]
+    changed += [obj for obj in db_session.dirty
+                if isinstance(obj, Message) and db_session.is_modified(obj, include_collections=False)]
+    if changed:
+        version = next_change_version(db_session)
+        for message in changed:
+            message.changeVersion = version
+
+@event.listens_for(Session, 'before_flush')
+def _stamp_solved_at(db_session, flush_context, instances):
+    for message in [*db_session.new, *db_session.dirty]:
+        if isinstance(message, Message) and message.status == 'Solved' and message.solvedAt is None:
+            message.solvedAt = time.time()
+
+class MessageCounter(Base):
+    """Maintained message counts per team (key = team name) and per member (key = member id)."""
+    __tablename__ = 'message_counters'
+
+    scope = Column(String, primary_key=True)  # 'team' or 'member'
+    key = Column(String, primary_key=True)
+    pending = Column(Integer, nullable=False, default=0)
+    in_progress = Column(Integer, nullable=False, default=0)
+    solved = Column(Integer, nullable=False, default=0)
+
+# Message.status -> MessageCounter column
+COUNTED_STATUSES = {'Pending': 'pending', 'In Progress': 'in_progress', 'Solved': 'solved'}
+
+def _counter_keys(state):
+    """Counters a message in `state` = (routingTeam, status, assigned_to) contributes to."""
+    team, status, member_id = state
+    column = COUNTED_STATUSES.get(status)
+    if column is None:
+        return []
+    keys = [('team', team or UNCLASSIFIED, column)]
+    if member_id is not None:
+        keys.append(('member', str(member_id), column))
+    return keys
+
+def count_transitions(db_session, transitions):
+    """
+    Apply message state changes to the counters inside the caller's
+    transaction. `transitions` is an iterable of (before, after), each a
+    (routingTeam, status, assigned_to) tuple or None for insert/delete. Bulk
+    UPDATEs of messages must call this; ORM changes are counted by the
+    before_flush hook below.
+    """
+    deltas = {}
+    for before, after in transitions:
+        for key in _counter_keys(before) if before else []:
+            deltas[key] = deltas.get(key, 0) - 1
+        for key in _counter_keys(after) if after else []:
+            deltas[key] = deltas.get(key, 0) + 1
+
+    table = MessageCounter.__table__
+    connection = db_session.connection()
+    for (scope, key, column), delta in deltas.items():
+        if not delta:
+            continue
+        where = (table.c.scope == scope) & (table.c.key == key)
+        # Increment in SQL so concurrent writers never lose an update
+        if connection.execute(update(table).where(where).values({column: table.c[column] + delta})).rowcount:
+            continue
+        try:
+            with connection.begin_nested():
+                connection.execute(table.insert().values(
+                    {'scope': scope, 'key': key, 'pending': 0, 'in_progress': 0, 'solved': 0, column: delta}))
+        except IntegrityError:
+            # Created concurrently; add to it instead
+            connection.execute(update(table).where(where).values({column: table.c[column] + delta}))
+
+def rebuild_counters(connection):
+    """Recompute every counter from the messages table; archived messages still count as solved."""
+    table = MessageCounter.__table__
+    connection.execute(table.delete())
+    rows = {}
+    grouped = []
+    tables = [Message.__table__]
+    # Older migrations rebuild counters before the archive table exists
+    if inspect(connection).has_table(ArchivedMessage.__tablename__):
+        tables.append(ArchivedMessage.__table__)
+    for messages in tables:
+        team = func.coalesce(messages.c.routingTeam, UNCLASSIFIED)
+        grouped += [
+            ('team', select(team, messages.c.status, func.count()).group_by(team, messages.c.status)),
+            ('member', select(messages.c.assigned_to, messages.c.status, func.count())
+                .where(messages.c.assigned_to.isnot(None)).group_by(messages.c.assigned_to, messages.c.status)),
+        ]
+    for scope, query in grouped:
+        for key, status, count in connection.execute(query):
+            column = COUNTED_STATUSES.get(status)
+            if column:
+                row = rows.setdefault((scope, str(key)), {'scope': scope, 'key': str(key),
+                                                         'pending': 0, 'in_progress': 0, 'solved': 0})
+                row[column] += count
+    if rows:
+        connection.execute(table.insert(), list(rows.values()))
+
+def _message_state(message, history=False):
+    if not history:
+        return (message.routingTeam, message.status, message.assigned_to)
+    state = []
+    for name in ('routingTeam', 'status', 'assigned_to'):
+        changes = inspect(message).attrs[name].history
+        state.append(changes.deleted[0] if changes.deleted else getattr(message, name))
+    return tuple(state)
+
+@event.listens_for(Session, 'before_flush')
+def _count_message_changes(db_session, flush_context, instances):
+    transitions = [(None, _message_state(obj)) for obj in db_session.new if isinstance(obj, Message)]
+    transitions += [(_message_state(obj, history=True), _message_state(obj))
+                    for obj in db_session.dirty if isinstance(obj, Message)]
+    transitions += [(_message_state(obj, history=True), None)
+                    for obj in db_session.deleted if isinstance(obj, Message)]
+    if any(before != after for before, after in transitions):
+        count_transitions(db_session, transitions)
+
 def initialize_teams():
     session = Session()
     try:
@@ -118,15 +600,18 @@ def initialize_teams():
 def initialize_db():
     # Create all tables if they don't exist
     Base.metadata.create_all(engine)
+    # Bring tables of an existing database file up to date
+    from migrations import run_migrations
+    run_migrations()
     
     session = Session()
     try:
         # Initialize teams only if teams table is empty
-        if session.query(Team).count() == 0:
+        if session.query(Team.id).first() is None:
             initialize_teams()
             
             # Add sample messages only if messages table is empty
-            if session.query(Message).count() == 0:
+            if session.query(Message.id).first() is None:
                 sample_messages = [
                     Message(
                         queryNumber=1,
@@ -0,0 +1,288 @@
+# prefilter.py
+
+import bisect
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import or_
+
+import classifier
+from classifier import Classification, labels
+from metrics import classifier_stage_duration
+from model import Session, Message
+
+# Answers below this confidence fall through to the seq2seq classifier
+THRESHOLD = float(os.environ.get("PREFILTER_THRESHOLD", 0.9))
+ENABLED = os.environ.get("PREFILTER", "1") != "0"
+# The linear tier is only used once it has seen this many labelled messages
+MIN_TRAINING_ROWS = int(os.environ.get("PREFILTER_MIN_TRAINING_ROWS", 200))
+TRAINING_ROWS = int(os.environ.get("PREFILTER_TRAINING_ROWS", 50000))
+RETRAIN_INTERVAL = float(os.environ.get("PREFILTER_RETRAIN_INTERVAL", 3600))
+# A keyword answers only after it matched this many labelled messages on its own
+KEYWORD_MIN_MATCHES = int(os.environ.get("PREFILTER_KEYWORD_MIN_MATCHES", 20))
+# Share of the labelled messages held out to measure the linear tier's precision (0 turns the tier off)
+HOLDOUT_SHARE = float(os.environ.get("PREFILTER_HOLDOUT_SHARE", 0.2))
+# Lower bounds of the raw linear-tier confidence buckets that precision is measured for
+CALIBRATION_BUCKETS = (0.5, 0.7, 0.8, 0.9, 0.95, 0.98, 0.99, 0.999)
+# A bucket answers only after this many held-out messages fell into it
+CALIBRATION_MIN_ROWS = int(os.environ.get("PREFILTER_CALIBRATION_MIN_ROWS", 20))
+
+# Phrases that may identify a label. A message matching phrases of more than
+# one label is ambiguous and left to the other tiers; how often a phrase is
+# right is measured on labelled messages, see KeywordClassifier.calibrate().
+KEYWORDS = {
+    "Booking Issue": ["book", "booking", "booked", "reservation", "reserve"],
+    "Subscription Plan Issue": ["subscription", "subscribe", "renewal", "renew", "membership", "plan"],
+    "Payment Issue": ["payment", "pay", "paid", "charged", "refund", "deducted", "transaction", "card"],
+    "Driver No Show Issue": ["didn't show", "didnt show", "did not show", "no show", "never came",
+                             "never arrived", "didn't come", "did not come", "driver not arrived"],
+    "Ride Delay Issue": ["late", "delay", "delayed", "still waiting", "waiting for"],
+    "Route Issue": ["route", "wrong way", "detour", "wrong direction", "longer way"],
+    "Account Profile Issue": ["account", "profile", "login", "log in", "password", "otp"],
+    "Customer Support Issue": ["support", "customer care", "customer service", "no response", "complaint"],
+}
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(text):
+    words = _TOKEN.findall((text or "").lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class KeywordClassifier:
+    """
+    Tier 1: fixed phrase rules, answering only when exactly one label matches.
+    The confidence of an answer is the measured precision of its best matched
+    phrase; phrases not yet calibrated do not answer.
+    """
+
+    def __init__(self, keywords=KEYWORDS):
+        self.single = defaultdict(set)
+        self.phrases = []
+        for label, phrases in keywords.items():
+            for phrase in phrases:
+                if " " in phrase:
+                    self.phrases.append((phrase, label))
+                else:
+                    self.single[phrase].add((phrase, label))
+        self.precision = {}  # phrase -> share of its sole-label matches that were right
+
+    def match(self, text):
+        """(label, matched phrases) when the phrases of exactly one label occur in `text`, else None."""
+        lowered = (text or "").lower()
+        matched = set()
+        for word in _TOKEN.findall(lowered):
+            matched |= self.single.get(word, set())
+        for phrase, label in self.phrases:
+            if phrase in lowered:
+                matched.add((phrase, label))
+        found = {label for _, label in matched}
+        if len(found) != 1:
+            return None
+        return found.pop(), {phrase for phrase, _ in matched}
+
+    def calibrate(self, rows):
+        """Measure each phrase's precision on (text, label) rows labelled by the model."""
+        hits, correct = Counter(), Counter()
+        for text, label in rows:
+            match = self.match(text)
+            if match is None:
+                continue
+            for phrase in match[1]:
+                hits[phrase] += 1
+                correct[phrase] += match[0] == label
+        # Laplace-smoothed, so a handful of lucky matches does not look certain
+        self.precision = {phrase: (correct[phrase] + 1) / (count + 2)
+                          for phrase, count in hits.items() if count >= KEYWORD_MIN_MATCHES}
+
+    def predict(self, text):
+        match = self.match(text)
+        if match is None:
+            return None
+        precision = self.precision
+        measured = [precision[phrase] for phrase in match[1] if phrase in precision]
+        if not measured:
+            return None
+        return match[0], max(measured)
+
+
+class NaiveBayesClassifier:
+    """
+    Tier 2: multinomial naive Bayes over word unigrams and bigrams, trained
+    from stored messages whose queryType came from the seq2seq model. Its raw
+    posterior is far too confident, so an answer carries the precision measured
+    on held-out messages for its confidence bucket; buckets without enough
+    held-out messages do not answer.
+    """
+
+    def __init__(self):
+        self.trained_rows = 0
+        self.log_priors = {}
+        self.log_likelihoods = {}
+        self.log_unseen = {}
+        self.calibration = {}  # bucket lower bound -> measured precision
+
+    def train(self, rows, held_out=()):
+        token_counts = defaultdict(Counter)
+        label_counts = Counter()
+        for text, label in rows:
+            label_counts[label] += 1
+            token_counts[label].update(tokenize(text))
+
+        total = sum(label_counts.values())
+        vocabulary = set()
+        for counts in token_counts.values():
+            vocabulary.update(counts)
+
+        log_priors, log_likelihoods, log_unseen = {}, {}, {}
+        for label, count in label_counts.items():
+            counts = token_counts[label]
+            denominator = sum(counts.values()) + len(vocabulary)
+            log_priors[label] = math.log(count / total)
+            log_likelihoods[label] = {token: math.log((n + 1) / denominator) for token, n in counts.items()}
+            log_unseen[label] = math.log(1 / denominator)
+
+        hits, correct = Counter(), Counter()
+        for text, label in held_out:
+            prediction = self._posterior(text, log_priors, log_likelihoods, log_unseen)
+            bucket = prediction and _bucket(prediction[1])
+            if bucket is not None:
+                hits[bucket] += 1
+                correct[bucket] += prediction[0] == label
+        # Laplace-smoothed like the keyword precision
+        calibration = {bucket: (correct[bucket] + 1) / (count + 2)
+                       for bucket, count in hits.items() if count >= CALIBRATION_MIN_ROWS}
+
+        # Swap in the new model in one step so concurrent predict() calls see a consistent state
+        self.log_priors, self.log_likelihoods, self.log_unseen, self.calibration = \
+            log_priors, log_likelihoods, log_unseen, calibration
+        self.trained_rows = total
+
+    @staticmethod
+    def _posterior(text, log_priors, log_likelihoods, log_unseen):
+        tokens = tokenize(text)
+        if not tokens or not log_priors:
+            return None
+        scores = {}
+        for label, prior in log_priors.items():
+            likelihoods = log_likelihoods[label]
+            unseen = log_unseen[label]
+            scores[label] = prior + sum(likelihoods.get(token, unseen) for token in tokens)
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        return best, 1 / sum(math.exp(score - top) for score in scores.values())
+
+    def predict(self, text):
+        if self.trained_rows < MIN_TRAINING_ROWS:
+            return None
+        prediction = self._posterior(text, self.log_priors, self.log_likelihoods, self.log_unseen)
+        if prediction is None:
+            return None
+        precision = self.calibration.get(_bucket(prediction[1]))
+        if precision is None:
+            return None
+        return prediction[0], precision
+
+
+def _bucket(confidence):
+    """Lower bound of the CALIBRATION_BUCKETS bucket holding `confidence`, or None below the first."""
+    index = bisect.bisect_right(CALIBRATION_BUCKETS, confidence)
+    return CALIBRATION_BUCKETS[index - 1] if index else None
+
+
+class CascadeClassifier:
+    """
+    Answers from the cheap tiers when they are confident enough and sends
+    everything else to the seq2seq classifier. Every Classification carries the
+    tier that produced it ("keyword", "linear", "cache" or "model").
+    """
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.keywords = KeywordClassifier()
+        self.linear = NaiveBayesClassifier()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._trained_at = 0.0
+        self._training = False
+
+    def train_from_database(self):
+        db_session = Session()
+        try:
+            rows = db_session.query(Message.message, Message.queryType).filter(
+                Message.queryType.in_(labels),
+                or_(Message.classifiedBy.is_(None), Message.classifiedBy == 'model')
+            ).order_by(Message.id.desc()).limit(TRAINING_ROWS).all()
+        finally:
+            db_session.close()
+        # Every n-th row is held out, so the split is the same on every run over the same rows
+        every = max(2, round(1 / HOLDOUT_SHARE)) if HOLDOUT_SHARE > 0 else 0
+        held_out = [row for index, row in enumerate(rows) if every and index % every == 0]
+        training = [row for index, row in enumerate(rows) if not every or index % every]
+        self.linear.train(training, held_out)
+        self.keywords.calibrate(rows)
+        print(f"📚 Pre-classifier trained on {self.linear.trained_rows} message(s), "
+              f"{len(self.linear.calibration)} confidence bucket(s) and "
+              f"{len(self.keywords.precision)} keyword(s) calibrated")
+
+    def train_in_background(self):
+        with self._lock:
+            if self._training:
+                return
+            self._training = True
+            self._trained_at = time.time()
+        threading.Thread(target=self._train_safely, name="prefilter-training", daemon=True).start()
+
+    def _train_safely(self):
+        try:
+            self.train_from_database()
+        except Exception as e:
+            print(f"❌ Error training pre-classifier: {str(e)}")
+        finally:
+            self._training = False
+
+    def predict(self, text):
+        """Return a Classification from the cheap tiers, or None to fall back."""
+        for tier, tier_classifier in (("keyword", self.keywords), ("linear", self.linear)):
+            prediction = tier_classifier.predict(text)
+            if prediction and prediction[1] >= self.threshold:
+                return Classification(prediction[0], prediction[1], None, tier)
+        return None
+
+    def classify_many(self, messages):
+        if ENABLED and time.time() - self._trained_at > RETRAIN_INTERVAL:
+            self.train_in_background()
+
+        with classifier_stage_duration.time(stage="prefilter"):
+            results = [self.predict(message) if ENABLED else None for message in messages]
+        fallback = [message for message, result in zip(messages, results) if result is None]
+        if fallback:
+            answered = iter(classifier.classify_many(fallback))
+            results = [result or next(answered) for result in results]
+
+        with self._lock:
+            self.counts.update(result.tier for result in results)
+        return results
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        fallback = counts.get('model', 0) + counts.get('cache', 0)
+        return {
+            'threshold': self.threshold,
+            'trained_rows': self.linear.trained_rows,
+            'calibrated_keywords': len(self.keywords.precision),
+            'linear_calibration': {str(bucket): round(precision, 4)
+                                   for bucket, precision in sorted(self.linear.calibration.items())},
+            'tiers': counts,
+            'fallback_rate': round(fallback / total, 4) if total else 0.0
+        }
+
+
+cascade = CascadeClassifier()
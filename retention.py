@@ -0,0 +1,182 @@
+# retention.py
+#
+# Moves messages that were solved more than RETENTION_DAYS ago out of
+# `messages` into `messages_archive`, so the live table only holds recent and
+# open work. Each batch is copied and deleted in one transaction; other
+# writers get the database between batches. The database is compacted
+# afterwards once enough of it is free space. Archived messages are read
+# through /api/archive/messages and still count as solved in the stats.
+#
+#   python retention.py                  # archive with the configured age
+#   python retention.py --days 30 --vacuum
+
+import argparse
+import os
+import threading
+import time
+
+from sqlalchemy import delete, func, literal, select, text
+
+from events import broker
+from model import Session, Message, ArchivedMessage, ClassificationJob, engine, next_change_version, initialize_db
+from search import FTS_TABLE, fts_available
+
+RETENTION_DAYS = float(os.environ.get("RETENTION_DAYS", 90))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 1000))
+# Run the job inside the app every this many seconds; 0 leaves it to cron and the CLI
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", 0))
+# VACUUM a SQLite file once this share of its pages is free
+RETENTION_VACUUM_FREE_RATIO = float(os.environ.get("RETENTION_VACUUM_FREE_RATIO", 0.25))
+
+# Columns copied as they are; the archive adds archivedAt and archivedVersion
+ARCHIVED_COLUMNS = [column.name for column in ArchivedMessage.__table__.columns
+                    if column.name in Message.__table__.columns]
+
+_run_lock = threading.Lock()
+last_run = None
+
+
+def archive_batch(cutoff, batch_size=RETENTION_BATCH_SIZE):
+    """Archive up to `batch_size` messages solved before `cutoff` (epoch seconds). Returns how many."""
+    messages = Message.__table__
+    db_session = Session()
+    try:
+        # `messages` has no AUTOINCREMENT, so SQLite hands out MAX(id) + 1: deleting
+        # the newest row would let the next message reuse its id, which the
+        # archive (and delta clients) already know as removed
+        newest_id = db_session.query(func.max(Message.id)).scalar()
+        if newest_id is None:
+            return 0
+        ids = [row.id for row in db_session.query(Message.id).filter(
+            Message.status == 'Solved',
+            Message.solvedAt < cutoff,
+            Message.id < newest_id
+        ).order_by(Message.id).limit(batch_size)]
+        if not ids:
+            return 0
+        selected = (messages.c.id.in_(ids)) & (messages.c.status == 'Solved')
+        # Lets delta clients see the archived rows as removed
+        version = next_change_version(db_session)
+        db_session.execute(ArchivedMessage.__table__.insert().from_select(
+            ARCHIVED_COLUMNS + ['archivedAt', 'archivedVersion'],
+            select(*[messages.c[name] for name in ARCHIVED_COLUMNS], literal(time.time()), literal(version))
+            .where(selected)))
+        db_session.execute(delete(ClassificationJob).where(ClassificationJob.message_id.in_(ids)))
+        archived = db_session.execute(messages.delete().where(selected)).rowcount
+        db_session.commit()
+        return archived
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+def compact(force=False):
+    """
+    Give the space of archived rows back: VACUUM on SQLite once enough pages
+    are free (or `force`), VACUUM ANALYZE on PostgreSQL. Returns True if it
+    vacuumed.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text("VACUUM ANALYZE messages"))
+            return True
+        if connection.dialect.name != 'sqlite':
+            return False
+        if fts_available():
+            # Merge the FTS index segments left behind by the deletes
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+        pages = connection.execute(text("PRAGMA page_count")).scalar()
+        free = connection.execute(text("PRAGMA freelist_count")).scalar()
+        vacuum = force or (pages and free / pages >= RETENTION_VACUUM_FREE_RATIO)
+        if vacuum:
+            connection.execute(text("VACUUM"))
+            connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        connection.execute(text("PRAGMA optimize"))
+        return bool(vacuum)
+
+
+def run_retention(days=RETENTION_DAYS, batch_size=RETENTION_BATCH_SIZE, vacuum=None):
+    """
+    Archive every message solved more than `days` ago, then compact: always
+    with vacuum=True, never with False, by free space with None. Returns a
+    summary, or None if a run is already in progress.
+    """
+    global last_run
+    if not _run_lock.acquire(blocking=False):
+        return None
+    try:
+        started = time.perf_counter()
+        cutoff = time.time() - days * 86400
+        archived = batches = 0
+        while True:
+            count = archive_batch(cutoff, batch_size)
+            if not count:
+                break
+            archived += count
+            batches += 1
+        if archived:
+            print(f"🗄️ Archived {archived} solved message(s) older than {days:g} day(s) in {batches} batch(es)")
+            broker.publish('message', {'archived': archived})
+        compacted = False
+        if vacuum or (vacuum is None and archived):
+            compacted = compact(force=bool(vacuum))
+        last_run = {
+            'archived': archived,
+            'batches': batches,
+            'cutoff': cutoff,
+            'compacted': compacted,
+            'seconds': round(time.perf_counter() - started, 3),
+            'finished_at': time.time()
+        }
+        return last_run
+    finally:
+        _run_lock.release()
+
+
+def run_in_background(days=RETENTION_DAYS, vacuum=None):
+    """Start run_retention() in a thread; returns False if a run is already in progress."""
+    if _run_lock.locked():
+        return False
+    threading.Thread(target=_run_safely, args=(days, vacuum), name="retention", daemon=True).start()
+    return True
+
+
+def is_running():
+    return _run_lock.locked()
+
+
+def _run_safely(days=RETENTION_DAYS, vacuum=None):
+    try:
+        run_retention(days, vacuum=vacuum)
+    except Exception as e:
+        print(f"❌ Error archiving solved messages: {str(e)}")
+
+
+def start_scheduler(interval=RETENTION_INTERVAL):
+    """Run retention every `interval` seconds in a daemon thread (no-op when interval is 0)."""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            _run_safely()
+
+    thread = threading.Thread(target=loop, name="retention-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Archive old solved messages")
+    parser.add_argument('--days', type=float, default=RETENTION_DAYS, help="archive messages solved this long ago")
+    parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument('--vacuum', action='store_true', help="always compact the database afterwards")
+    parser.add_argument('--no-vacuum', action='store_true', help="never compact the database")
+    args = parser.parse_args()
+
+    initialize_db()
+    result = run_retention(args.days, args.batch_size, vacuum=True if args.vacuum else False if args.no_vacuum else None)
+    print(f"✅ {result}")
@@ -0,0 +1,118 @@
+# search.py
+#
+# Full-text search over Message.message. On SQLite the text is indexed in an
+# FTS5 table that mirrors `messages` (external content, so the text is not
+# stored twice) and is kept in sync by triggers, which also cover bulk
+# inserts and deletes that bypass the ORM. Other databases, or a SQLite
+# build without FTS5, fall back to a LIKE scan.
+
+import re
+
+from sqlalchemy import Column, Integer, MetaData, Table, Text, func, literal, literal_column, text
+
+from model import Message, engine
+
+FTS_TABLE = 'messages_fts'
+# Most results one search request may return, and how deep ranked results can be paged
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_MAX_OFFSET = 1000
+
+FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        message, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message);
+        INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message);
+    END""",
+]
+
+# Mapped in its own MetaData so create_all() leaves it to create_search_index()
+fts_table = Table(FTS_TABLE, MetaData(), Column('rowid', Integer, primary_key=True), Column('message', Text))
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+_fts_available = None
+
+
+def fts_supported(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    options = {row[0] for row in connection.execute(text('PRAGMA compile_options'))}
+    return 'ENABLE_FTS5' in options
+
+
+def create_search_index(connection):
+    """Create the FTS table and its triggers and index the existing messages."""
+    if not fts_supported(connection):
+        print("⚠️ SQLite FTS5 is not available; message search falls back to LIKE")
+        return
+    for statement in FTS_DDL:
+        connection.execute(text(statement))
+    rebuild_search_index(connection)
+
+
+def rebuild_search_index(connection):
+    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        with engine.connect() as connection:
+            _fts_available = fts_supported(connection) and connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+            ).first() is not None
+    return _fts_available
+
+
+def match_expression(query):
+    """
+    FTS5 MATCH expression for free text: every word must occur, the last one
+    as a prefix so results show up while typing. Words are quoted, so
+    characters like '-' or ':' in booking IDs are not read as query syntax.
+    """
+    terms = [f'"{term}"' for term in _TERM.findall(query)]
+    if not terms:
+        return None
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_messages(db_session, query, team=None, status=None, limit=SEARCH_PAGE_SIZE, offset=0, cursor=None,
+                    order='rank'):
+    """
+    Messages matching `query`, as (Message, rank) pairs. `order='rank'`
+    returns the best matches first (bm25, lower is better) and pages with
+    `offset`; `order='newest'` returns newest first and pages with `cursor`
+    (the last id seen). Returns None when `query` has no searchable words.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return None
+
+    if fts_available():
+        fts = literal_column(FTS_TABLE)
+        rank = func.bm25(fts).label('rank')
+        rows = db_session.query(Message, rank).select_from(fts_table).join(
+            Message, Message.id == fts_table.c.rowid).filter(fts.op('MATCH')(expression))
+    else:
+        rank = literal(None).label('rank')
+        rows = db_session.query(Message, rank)
+        for term in _TERM.findall(query):
+            rows = rows.filter(Message.message.ilike(f"%{term}%"))
+
+    if team:
+        rows = rows.filter(Message.routingTeam == team)
+    if status:
+        rows = rows.filter(Message.status == status)
+    if order == 'newest':
+        if cursor is not None:
+            rows = rows.filter(Message.id < cursor)
+        return rows.order_by(Message.id.desc()).limit(limit).all()
+    return rows.order_by(rank, Message.id.desc()).offset(offset).limit(limit).all()
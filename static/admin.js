@@ -10,35 +10,129 @@ async function fetchQueryTypes() {
     }
 }
 
-// Fetch messages from the database and populate the table
-async function fetchMessages() {
+// Cursor of the next page, null when everything has been loaded
+let nextCursor = null;
+// Change version the table is up to date with, see refreshMessages()
+let syncVersion = null;
+
+function currentFilters() {
+    const params = new URLSearchParams();
+    ['team', 'status', 'queryType'].forEach((name) => {
+        const value = document.getElementById(`filter-${name}`).value;
+        if (value) {
+            params.set(name, value);
+        }
+    });
+    return params;
+}
+
+function messageRow(message) {
+    const row = document.createElement('tr');
+    row.dataset.id = message._id;
+    row.innerHTML = `
+        <td>${message.queryNumber}</td>
+        <td>${message.message}</td>
+        <td>${message.routingTeam ?? "-"}</td>
+        <td>${message.queryType}</td>
+        <td>${message.confidentialityLevel != null ? message.confidentialityLevel + "%" : "-"}</td>
+        <td class="status ${message.status.toLowerCase()}">${message.status}</td>
+    `;
+    return row;
+}
+
+function appendMessages(messages) {
+    const tableBody = document.getElementById('message-table-body');
+    messages.forEach((message) => tableBody.appendChild(messageRow(message)));
+}
+
+// Apply changed rows in place: update loaded rows, add new ones on top, drop removed ones
+function mergeMessages(messages, removed) {
+    const tableBody = document.getElementById('message-table-body');
+    const newest = tableBody.firstElementChild ? Number(tableBody.firstElementChild.dataset.id) : 0;
+    messages.forEach((message) => {
+        const existing = tableBody.querySelector(`tr[data-id="${message._id}"]`);
+        if (existing) {
+            existing.replaceWith(messageRow(message));
+        } else if (message._id > newest) {
+            tableBody.prepend(messageRow(message));
+        }
+    });
+    removed.forEach((id) => tableBody.querySelector(`tr[data-id="${id}"]`)?.remove());
+}
+
+// Ask only for messages changed since the last sync; an unchanged table costs a 304
+async function refreshMessages() {
+    if (syncVersion === null) {
+        return;
+    }
     try {
-        const [messages, queryTypes] = await Promise.all([
-            fetch('/api/messages').then(r => r.json()),
-            fetchQueryTypes()
-        ]);
-
-        const tableBody = document.getElementById('message-table-body');
-        tableBody.innerHTML = '';
-
-        messages.forEach((message) => {
-            const row = document.createElement('tr');
-            row.innerHTML = `
-                <td>${message.queryNumber}</td>
-                <td>${message.message}</td>
-                <td>${message.routingTeam}</td>
-                <td>${message.queryType}</td>
-                <td>${message.confidentialityLevel}%</td>
-                <td class="status ${message.status.toLowerCase()}">${message.status}</td>
-            `;
-            tableBody.appendChild(row);
-        });
+        let more = true;
+        while (more) {
+            const params = currentFilters();
+            params.set('since', syncVersion);
+            const response = await fetch(`/api/messages?${params}`);
+            if (response.status === 304 || !response.ok) {
+                return;
+            }
+            const delta = await response.json();
+            mergeMessages(delta.messages, delta.removed);
+            syncVersion = delta.version;
+            more = delta.more;
+        }
     } catch (error) {
         console.error('Error:', error);
     }
 }
 
+// Fetch one page of messages and add it to the table
+async function fetchMessages(reset = true) {
+    try {
+        const params = currentFilters();
+        if (!reset && nextCursor !== null) {
+            params.set('cursor', nextCursor);
+        }
+        const page = await fetch(`/api/messages?${params}`).then(r => r.json());
+
+        if (reset) {
+            document.getElementById('message-table-body').innerHTML = '';
+            syncVersion = page.version;
+        }
+        appendMessages(page.messages);
+
+        nextCursor = page.next_cursor;
+        document.getElementById('load-more').style.display = nextCursor === null ? 'none' : '';
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
+async function populateFilters() {
+    const [queryTypes, teams] = await Promise.all([
+        fetchQueryTypes(),
+        fetch('/api/teams').then(r => r.json()).catch(() => [])
+    ]);
+    const addOptions = (id, values) => {
+        const select = document.getElementById(id);
+        values.forEach((value) => select.add(new Option(value, value)));
+    };
+    addOptions('filter-queryType', queryTypes);
+    addOptions('filter-team', Array.isArray(teams) ? teams.map(team => team.name) : []);
+}
+
 // Add event listeners for classification filters
 document.addEventListener('DOMContentLoaded', () => {
-    fetchMessages(); // Fetch all messages by default
-});
\ No newline at end of file
+    populateFilters();
+    fetchMessages(); // Fetch the newest messages by default
+
+    ['team', 'status', 'queryType'].forEach((name) => {
+        document.getElementById(`filter-${name}`).addEventListener('change', () => fetchMessages());
+    });
+    document.getElementById('load-more').addEventListener('click', () => fetchMessages(false));
+
+    // New, classified and picked-up messages are pushed; poll only without EventSource
+    const refresh = coalesce(refreshMessages);
+    if (!subscribeEvents({message: refresh, task: refresh}, refresh)) {
+        const refreshSeconds = Number(localStorage.getItem('refreshInterval')) || 30;
+        setInterval(refresh, refreshSeconds * 1000);
+    }
+});
@@ -0,0 +1,49 @@
+// Server-sent events from /api/events. `handlers` maps an event name to a
+// callback; `onResync` runs after a reconnect or when the server asks the page
+// to refetch because it fell behind. Returns null when the browser has no
+// EventSource, so the caller can fall back to polling.
+function subscribeEvents(handlers, onResync) {
+    if (!window.EventSource) {
+        return null;
+    }
+    const source = new EventSource('/api/events');
+    Object.entries(handlers).forEach(([name, handler]) => {
+        source.addEventListener(name, (event) => handler(JSON.parse(event.data)));
+    });
+
+    let connected = false;
+    source.addEventListener('open', () => {
+        // Events sent while disconnected are lost, so catch up after a reconnect
+        if (connected && onResync) {
+            onResync();
+        }
+        connected = true;
+    });
+    if (onResync) {
+        source.addEventListener('resync', () => onResync());
+    }
+    return source;
+}
+
+// Wrap an async refresh so a burst of events runs it at most once at a time,
+// plus once more if events arrived while it was running.
+function coalesce(refresh) {
+    let running = false;
+    let pending = false;
+    return async function run() {
+        if (running) {
+            pending = true;
+            return;
+        }
+        running = true;
+        try {
+            await refresh();
+        } finally {
+            running = false;
+            if (pending) {
+                pending = false;
+                run();
+            }
+        }
+    };
+}
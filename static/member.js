@@ -1,9 +1,44 @@
+// Open team queries by id and the change version they are up to date with
+let teamQueries = new Map();
+let syncVersion = null;
+
 async function fetchTeamQueries() {
     const response = await fetch('/api/member/team-queries');
     const queries = await response.json();
+    teamQueries = new Map(queries.map(query => [query.id, query]));
+    syncVersion = response.headers.get('X-Change-Version');
     renderQueries('team-queries', queries);
 }
 
+// Fetch only queries changed since the last sync; an unchanged list costs a 304
+async function refreshTeamQueries() {
+    if (syncVersion === null) {
+        return;
+    }
+    try {
+        let more = true;
+        let changed = false;
+        while (more) {
+            const response = await fetch(`/api/member/team-queries?since=${syncVersion}`);
+            if (response.status === 304 || !response.ok) {
+                break;
+            }
+            const delta = await response.json();
+            delta.queries.forEach(query => teamQueries.set(query.id, query));
+            delta.removed.forEach(id => teamQueries.delete(id));
+            syncVersion = delta.version;
+            more = delta.more;
+            changed = true;
+        }
+        if (changed) {
+            const queries = [...teamQueries.values()].sort((a, b) => a.id - b.id);
+            renderQueries('team-queries', queries);
+        }
+    } catch (error) {
+        console.error('Error:', error);
+    }
+}
+
 function renderQueries(containerId, queries) {
     const container = document.getElementById(containerId);
     container.innerHTML = queries.map(query => `
@@ -23,9 +58,29 @@ async function pickTask(queryId) {
     const response = await fetch(`/api/member/pick-task/${queryId}`, {
         method: 'POST'
     });
-    if (response.ok) {
-        fetchTeamQueries();
+    if (response.status === 409 || response.status === 404) {
+        alert('Someone else already picked up this query');
+    }
+    fetchTeamQueries();
+}
+
+// Take the oldest unassigned team queries without racing teammates over a specific row
+async function claimNext() {
+    const count = Number(document.getElementById('claim-count').value) || 1;
+    const response = await fetch('/api/member/claim-next', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ count })
+    });
+    const result = await response.json();
+    if (!response.ok) {
+        alert(result.error || 'Failed to pick up queries');
+    } else if (result.claimed.length === 0) {
+        alert('No queries left to pick up');
     }
+    fetchTeamQueries();
 }
 
 async function markAsSolved(queryId) {
@@ -50,4 +105,15 @@ async function markAsSolved(queryId) {
 }
 
 // Initialize dashboard
-document.addEventListener('DOMContentLoaded', fetchTeamQueries);
+document.addEventListener('DOMContentLoaded', () => {
+    if (!document.getElementById('team-queries')) {
+        return;
+    }
+    fetchTeamQueries();
+    // Team queries are pushed as they are routed or picked up; poll only without EventSource
+    const refresh = coalesce(refreshTeamQueries);
+    if (!subscribeEvents({message: refresh, task: refresh}, refresh)) {
+        const refreshSeconds = Number(localStorage.getItem('refreshInterval')) || 30;
+        setInterval(refresh, refreshSeconds * 1000);
+    }
+});
@@ -40,6 +40,10 @@ document.addEventListener('DOMContentLoaded', function() {
 
     if (document.getElementById('resetRequestsTable')) {
         fetchResetRequests();
+        // New and completed reset requests are pushed, but only by the worker process this
+        // page is connected to; a slow poll picks up the ones handled by other workers
+        const refresh = coalesce(fetchResetRequests);
+        setInterval(refresh, subscribeEvents({'password-reset': refresh}, refresh) ? 60000 : 5000);
     }
 });
 
@@ -82,9 +86,6 @@ async function fetchResetRequests() {
     }
 }
 
-// Add auto-refresh functionality
-setInterval(fetchResetRequests, 5000); // Refresh every 5 seconds
-
 async function handleReset(requestId, email) {
     const newPassword = prompt('Enter new password for ' + email);
     if (!newPassword) return;
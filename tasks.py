@@ -0,0 +1,221 @@
+# tasks.py
+
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import func, select
+
+from events import broker
+from model import Message, Team, TeamMember, count_transitions, next_change_version
+
+IN_PROGRESS = 'In Progress'
+# Most tasks one claim-next request may take
+CLAIM_NEXT_MAX = int(os.environ.get("CLAIM_NEXT_MAX", 20))
+# Assign classified messages to the least-loaded active team member instead of waiting for a pick-up
+AUTO_ASSIGN = os.environ.get("AUTO_ASSIGN", "0") == "1"
+# Reload member loads from the database this often, to pick up changes made by other processes
+DISPATCH_RESYNC_INTERVAL = float(os.environ.get("DISPATCH_RESYNC_INTERVAL", 60))
+
+
+def claim_task(db_session, message_id, member_id):
+    """
+    Assign a pending, unassigned message to `member_id` with one conditional UPDATE,
+    so of two members claiming at once exactly one wins. Returns True for the
+    winner. The caller commits, or rolls back when it lost.
+    """
+    claimed = db_session.query(Message).filter(
+        Message.id == message_id,
+        Message.assigned_to.is_(None),
+        Message.status == 'Pending'
+    ).update({
+        Message.assigned_to: member_id,
+        Message.status: IN_PROGRESS,
+        Message.changeVersion: next_change_version(db_session)
+    }, synchronize_session=False)
+    if not claimed:
+        return False
+    team = _team_of(db_session, message_id)
+    count_transitions(db_session, [((team, 'Pending', None), (team, IN_PROGRESS, member_id))])
+    return True
+
+
+def claim_next_tasks(db_session, member_id, team, count):
+    """
+    Assign up to `count` of the oldest pending, unassigned messages of `team`
+    to `member_id` in one UPDATE and return them. Rows another member took
+    first are skipped, so the result may be shorter. The caller commits.
+    """
+    version = next_change_version(db_session)
+    oldest = (select(Message.id)
+              .where(Message.routingTeam == team, Message.assigned_to.is_(None), Message.status == 'Pending')
+              .order_by(Message.id)
+              .limit(count))
+    claimed = db_session.query(Message).filter(
+        Message.id.in_(oldest),
+        Message.assigned_to.is_(None),
+        Message.status == 'Pending'
+    ).update({
+        Message.assigned_to: member_id,
+        Message.status: IN_PROGRESS,
+        Message.changeVersion: version
+    }, synchronize_session=False)
+    if not claimed:
+        return []
+    # The version is unique to this transaction, so it picks out exactly the rows claimed here
+    tasks = db_session.query(Message).filter(
+        Message.changeVersion == version,
+        Message.assigned_to == member_id
+    ).order_by(Message.id).all()
+    count_transitions(db_session, [((team, 'Pending', None), (team, IN_PROGRESS, member_id)) for _ in tasks])
+    return tasks
+
+
+def reassign_task(db_session, message_id, from_member_id, to_member_id):
+    """
+    Move an in-progress task from one member to another, or back to the team
+    queue when `to_member_id` is None. Returns False if the task was solved or
+    moved meanwhile. The caller commits.
+    """
+    moved = db_session.query(Message).filter(
+        Message.id == message_id,
+        Message.assigned_to == from_member_id,
+        Message.status == IN_PROGRESS
+    ).update({
+        Message.assigned_to: to_member_id,
+        Message.status: IN_PROGRESS if to_member_id else 'Pending',
+        Message.changeVersion: next_change_version(db_session)
+    }, synchronize_session=False)
+    if not moved:
+        return False
+    team = _team_of(db_session, message_id)
+    count_transitions(db_session, [((team, IN_PROGRESS, from_member_id),
+                                    (team, IN_PROGRESS if to_member_id else 'Pending', to_member_id))])
+    return True
+
+
+def _team_of(db_session, message_id):
+    return db_session.query(Message.routingTeam).filter(Message.id == message_id).scalar()
+
+
+class LeastLoadedDispatcher:
+    """
+    Assigns messages to the active member of their team with the fewest
+    in-progress tasks. Each team keeps a min-heap of (load, member_id); a
+    changed load pushes a new entry and outdated entries are discarded when
+    they reach the top, so picking a member is O(log n).
+    """
+
+    def __init__(self):
+        self._heaps = defaultdict(list)  # team name -> [(load, member_id)]
+        self._loads = {}  # member_id -> in-progress tasks, active members only
+        self._teams = {}  # member_id -> team name
+        self._lock = threading.Lock()
+        self._synced_at = 0.0
+
+    def sync(self, db_session):
+        """Rebuild the heaps from the active members and their in-progress counts."""
+        members = db_session.query(TeamMember.id, Team.name).join(
+            Team, TeamMember.team_id == Team.id).filter(TeamMember.status == 'active').all()
+        loads = dict(db_session.query(Message.assigned_to, func.count(Message.id)).filter(
+            Message.status == IN_PROGRESS,
+            Message.assigned_to.in_([member_id for member_id, _ in members])
+        ).group_by(Message.assigned_to).all())
+
+        heaps = defaultdict(list)
+        for member_id, team in members:
+            heaps[team].append((loads.get(member_id, 0), member_id))
+        for heap in heaps.values():
+            heapq.heapify(heap)
+        with self._lock:
+            self._heaps = heaps
+            self._teams = dict(members)
+            self._loads = {member_id: loads.get(member_id, 0) for member_id, _ in members}
+            self._synced_at = time.time()
+
+    def member_active(self, member_id, team, load=0):
+        with self._lock:
+            self._teams[member_id] = team
+            self._loads[member_id] = load
+            heapq.heappush(self._heaps[team], (load, member_id))
+
+    def member_inactive(self, member_id):
+        # Its heap entries go stale and are dropped lazily
+        with self._lock:
+            self._loads.pop(member_id, None)
+            self._teams.pop(member_id, None)
+
+    def adjust(self, member_id, delta):
+        """Record `delta` more in-progress tasks for a member (claims, solves)."""
+        with self._lock:
+            if member_id not in self._loads:
+                return
+            self._loads[member_id] = max(self._loads[member_id] + delta, 0)
+            heapq.heappush(self._heaps[self._teams[member_id]], (self._loads[member_id], member_id))
+
+    def _least_loaded(self, team):
+        heap = self._heaps.get(team)
+        while heap:
+            load, member_id = heap[0]
+            if self._loads.get(member_id) == load and self._teams.get(member_id) == team:
+                return member_id
+            heapq.heappop(heap)  # outdated entry
+        return None
+
+    def _resync_if_stale(self, db_session):
+        if time.time() - self._synced_at > DISPATCH_RESYNC_INTERVAL:
+            self.sync(db_session)
+
+    def dispatch(self, db_session, messages):
+        """
+        Assign each (message_id, team) to the least-loaded active member of the
+        team. Messages of teams without active members stay in the queue.
+        Commits every assignment and returns [(message_id, member_id)].
+        """
+        self._resync_if_stale(db_session)
+        assigned = []
+        for message_id, team in messages:
+            with self._lock:
+                member_id = self._least_loaded(team)
+            if member_id is None:
+                continue
+            if not claim_task(db_session, message_id, member_id):
+                db_session.rollback()  # picked up by hand meanwhile
+                continue
+            db_session.commit()
+            self.adjust(member_id, 1)
+            assigned.append((message_id, member_id))
+            broker.publish('task', {'id': message_id, 'status': IN_PROGRESS, 'assigned_to': member_id},
+                           team=team, member_id=member_id)
+        return assigned
+
+    def release(self, db_session, member_id):
+        """
+        Take a member out of rotation (logout) and hand all their in-progress
+        tasks, claimed by hand as well as dispatched, to the least-loaded
+        teammates, or back to the team queue. Commits.
+        """
+        self._resync_if_stale(db_session)
+        self.member_inactive(member_id)
+        tasks = db_session.query(Message.id, Message.routingTeam).filter(
+            Message.assigned_to == member_id, Message.status == IN_PROGRESS).all()
+        for message_id, team in tasks:
+            with self._lock:
+                new_member_id = self._least_loaded(team)
+            if not reassign_task(db_session, message_id, member_id, new_member_id):
+                db_session.rollback()
+                continue
+            db_session.commit()
+            if new_member_id:
+                self.adjust(new_member_id, 1)
+            broker.publish('task', {
+                'id': message_id,
+                'status': IN_PROGRESS if new_member_id else 'Pending',
+                'assigned_to': new_member_id
+            }, team=team, member_id=new_member_id)
+        return len(tasks)
+
+
+dispatcher = LeastLoadedDispatcher()
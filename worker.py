@@ -0,0 +1,228 @@
+# worker.py
+
+import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import or_, select
+
+from model import Session, Message, ClassificationJob, team_registry, count_transitions, next_change_version
+from prefilter import cascade
+from events import broker
+from metrics import worker_stage_duration
+from tasks import AUTO_ASSIGN, dispatcher
+
+# Number of background threads draining the classification queue
+WORKER_COUNT = int(os.environ.get("CLASSIFIER_WORKERS", 2))
+# Jobs claimed per round trip; the classifier batches them into one forward pass
+CLAIM_BATCH_SIZE = int(os.environ.get("CLASSIFIER_CLAIM_BATCH", 8))
+# A claim older than this is considered abandoned (crashed worker / restart) and is retried
+CLAIM_TIMEOUT = float(os.environ.get("CLASSIFIER_CLAIM_TIMEOUT", 60))
+MAX_ATTEMPTS = int(os.environ.get("CLASSIFIER_MAX_ATTEMPTS", 5))
+POLL_INTERVAL = float(os.environ.get("CLASSIFIER_POLL_INTERVAL", 2))
+# Stored when the classifier does not report a confidence (generate mode)
+DEFAULT_CONFIDENCE = 80
+
+
+def enqueue_message(db_session, message):
+    """Add a stored message to the durable classification queue (caller commits)."""
+    if message.id is None:
+        db_session.flush()
+    job = ClassificationJob(message_id=message.id, enqueued_at=time.time(), attempts=0)
+    db_session.add(job)
+    return job
+
+
+def claim_jobs(limit, owner):
+    """
+    Atomically claim up to `limit` unclaimed (or abandoned) jobs for `owner`.
+    Returns a list of (job_id, message_id, text, attempts).
+    """
+    db_session = Session()
+    try:
+        now = time.time()
+        claimable = or_(ClassificationJob.claimed_at.is_(None),
+                        ClassificationJob.claimed_at < now - CLAIM_TIMEOUT)
+        candidates = (select(ClassificationJob.id)
+                      .where(claimable)
+                      .order_by(ClassificationJob.id)
+                      .limit(limit))
+        token = f"{owner}:{uuid.uuid4().hex}"
+        claimed = db_session.query(ClassificationJob).filter(
+            ClassificationJob.id.in_(candidates),
+            claimable
+        ).update({
+            ClassificationJob.claimed_at: now,
+            ClassificationJob.claimed_by: token,
+            ClassificationJob.attempts: ClassificationJob.attempts + 1
+        }, synchronize_session=False)
+        db_session.commit()
+        if not claimed:
+            return []
+
+        return db_session.query(
+            ClassificationJob.id,
+            ClassificationJob.message_id,
+            Message.message,
+            ClassificationJob.attempts
+        ).join(Message, Message.id == ClassificationJob.message_id).filter(
+            ClassificationJob.claimed_by == token
+        ).order_by(ClassificationJob.id).all()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+
+def confidence_percent(result):
+    if result.confidence is None:
+        return DEFAULT_CONFIDENCE
+    return int(round(result.confidence * 100))
+
+
+def complete_jobs(results):
+    """Store (job_id, message_id, Classification) results and remove the jobs from the queue."""
+    db_session = Session()
+    try:
+        version = next_change_version(db_session)
+        states = {row.id: (row.routingTeam, row.status, row.assigned_to) for row in db_session.query(
+            Message.id, Message.routingTeam, Message.status, Message.assigned_to
+        ).filter(Message.id.in_([message_id for _, message_id, _ in results]))}
+        routed = []
+        transitions = []
+        lookup_seconds = 0.0
+        started = time.perf_counter()
+        for job_id, message_id, result in results:
+            lookup_started = time.perf_counter()
+            team = team_registry.team_for_category(result.label) or "Other"
+            lookup_seconds += time.perf_counter() - lookup_started
+            db_session.query(Message).filter_by(id=message_id).update({
+                Message.queryType: result.label,
+                Message.routingTeam: team,
+                Message.confidentialityLevel: confidence_percent(result),
+                Message.classifiedBy: result.tier,
+                Message.changeVersion: version
+            }, synchronize_session=False)
+            db_session.query(ClassificationJob).filter_by(id=job_id).delete(synchronize_session=False)
+            routed.append((message_id, result.label, team))
+            if message_id in states:
+                before = states[message_id]
+                transitions.append((before, (team,) + before[1:]))
+        worker_stage_duration.observe(lookup_seconds, stage="team_lookup")
+        worker_stage_duration.observe(time.perf_counter() - started - lookup_seconds, stage="update")
+        with worker_stage_duration.time(stage="counters"):
+            count_transitions(db_session, transitions)
+        with worker_stage_duration.time(stage="commit"):
+            db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        db_session.close()
+
+    for message_id, label, team in routed:
+        broker.publish('message', {'id': message_id, 'queryType': label, 'routingTeam': team}, team=team)
+
+    if AUTO_ASSIGN:
+        db_session = Session()
+        try:
+            with worker_stage_duration.time(stage="dispatch"):
+                dispatcher.dispatch(db_session, [(message_id, team) for message_id, _, team in routed])
+        finally:
+            db_session.close()
+
+
+def abandon_jobs(job_ids):
+    """Give up on jobs that failed MAX_ATTEMPTS times; their messages are routed to 'Other'."""
+    db_session = Session()
+    try:
+        abandoned = []
+        for job_id in job_ids:
+            job = db_session.query(ClassificationJob).get(job_id)
+            if job:
+                before = db_session.query(Message.routingTeam, Message.status, Message.assigned_to).filter_by(
+                    id=job.message_id).first()
+                if before:
+                    count_transitions(db_session, [(tuple(before), ("Other",) + tuple(before)[1:])])
+                db_session.query(Message).filter_by(id=job.message_id).update({
+                    Message.routingTeam: "Other",
+                    Message.changeVersion: next_change_version(db_session)
+                }, synchronize_session=False)
+                db_session.delete(job)
+                abandoned.append(job.message_id)
+        db_session.commit()
+    finally:
+        db_session.close()
+
+    for message_id in abandoned:
+        broker.publish('message', {'id': message_id, 'routingTeam': "Other"}, team="Other")
+
+
+class ClassificationWorkerPool:
+    """
+    Background threads that pull messages off the durable queue, classify them
+    and write back queryType/routingTeam. Jobs live in the database, so nothing
+    is lost when the process restarts: unfinished claims simply time out and are
+    picked up again.
+    """
+
+    def __init__(self, workers=WORKER_COUNT, batch_size=CLAIM_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(f"worker-{os.getpid()}-{i}",),
+                                      name=f"classification-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"🧵 Started {self.workers} classification worker(s)")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def notify(self):
+        """Wake idle workers after a message was enqueued."""
+        self._wakeup.set()
+
+    def _run(self, owner):
+        while not self._stopped.is_set():
+            try:
+                started = time.perf_counter()
+                jobs = claim_jobs(self.batch_size, owner)
+                if jobs:
+                    worker_stage_duration.observe(time.perf_counter() - started, stage="claim")
+            except Exception as e:
+                print(f"❌ Error claiming classification jobs: {str(e)}")
+                jobs = []
+
+            if not jobs:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            self._process(jobs)
+
+    def _process(self, jobs):
+        try:
+            with worker_stage_duration.time(stage="classify"):
+                predicted = cascade.classify_many([text or "" for _, _, text, _ in jobs])
+            complete_jobs([(job_id, message_id, result)
+                           for (job_id, message_id, _, _), result in zip(jobs, predicted)])
+            print(f"🔍 Classified {len(jobs)} queued message(s)")
+        except Exception as e:
+            print(f"❌ Error classifying queued messages: {str(e)}")
+            exhausted = [job_id for job_id, _, _, attempts in jobs if attempts >= MAX_ATTEMPTS]
+            if exhausted:
+                abandon_jobs(exhausted)